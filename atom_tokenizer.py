@@ -0,0 +1,51 @@
+import re
+import numpy as np
+
+
+# From https://github.com/pschwllr/MolecularTransformer
+# Should also work with selfies (thanks to the [])
+ATOMWISE_REGEX = re.compile(
+    r'(\[[^\]]+]|Br?|Cl?|N|O|S|P|F|I|b|c|n|o|s|p|\(|\)'
+    r'|\.|=|#|-|\+|\\|\/|:|~|@|\?|>|\*|\$|\%[0-9]{2}|[0-9])')
+
+
+def atomwise_tokenizer(smiles):
+    tokens = ATOMWISE_REGEX.findall(smiles)
+    assert smiles == ''.join(tokens)
+    return ' '.join(tokens)
+
+
+def tokenize_many(lines, vocab=None, unk_id=None):
+    """ Atom-tokenize many smiles (or selfies) lines at once
+    Args:
+        - lines: iterable of untokenized smiles strings (trailing newlines ok)
+        - vocab: if given, dict mapping tokens to ids, in which case int32
+            arrays of token ids are returned instead of space-joined strings
+        - unk_id: id for tokens missing from vocab (by default, raise an error)
+    """
+    if vocab is None:
+        return [atomwise_tokenizer(line.strip()) for line in lines]
+    return [intern_tokens(ATOMWISE_REGEX.findall(line.strip()), vocab, unk_id)
+            for line in lines]
+
+
+def intern_tokens(tokens, vocab, unk_id=None):
+    if unk_id is None:
+        token_ids = [vocab[token] for token in tokens]
+    else:
+        token_ids = [vocab.get(token, unk_id) for token in tokens]
+    return np.array(token_ids, dtype=np.int32)
+
+
+def load_token_vocab(vocab_path, specials=()):
+    """ Build a fixed token -> id mapping from an open-nmt vocabulary file
+        (one token per line, optionally followed by a tab and its count),
+        where special tokens, if any, take the first ids
+    """
+    vocab = {token: i for i, token in enumerate(specials)}
+    with open(vocab_path, 'r') as f:
+        for line in f:
+            token = line.rstrip('\n').split('\t')[0]
+            if len(token) > 0 and token not in vocab:
+                vocab[token] = len(vocab)
+    return vocab
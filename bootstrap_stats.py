@@ -0,0 +1,78 @@
+import numpy as np
+
+
+MAX_RESAMPLED_ITEMS = 1 << 24  # values gathered at once by the index matrix
+
+
+def compute_topk_hits(hit_ranks, ks):
+    """ Boolean matrix of top-k hits (one row per k, one column per sample),
+        from first hit ranks (1-based, 0 if no hit)
+    """
+    ks = np.asarray(ks)[:, None]
+    return (hit_ranks[None, :] > 0) & (hit_ranks[None, :] <= ks)
+
+
+def iter_resample_indices(n_samples, n_resamples, seed, batch_size):
+    """ Yield matrices of sample indices, one row per resample; the same seed
+        and number of samples always give the same resamples, so that models
+        evaluated on the same samples are resampled identically (paired)
+    """
+    rng = np.random.RandomState(seed)
+    for start in range(0, n_resamples, batch_size):
+        n_rows = min(batch_size, n_resamples - start)
+        yield rng.randint(0, n_samples, size=(n_rows, n_samples))
+
+
+def bootstrap_topk_accuracies(all_hit_ranks, ks, n_resamples, seed=0):
+    """ Top-k accuracies of one or several models evaluated on the same
+        samples, for all bootstrap resamples of these samples at once
+    Args:
+        - all_hit_ranks: list of first hit ranks of the samples, one per model
+        - ks: values of k for which accuracies are computed
+        - n_resamples: number of bootstrap resamples of the samples
+        - seed: seed of the resamples
+    Returns:
+        - observed accuracies (n_models x n_ks)
+        - resampled accuracies (n_models x n_ks x n_resamples)
+    """
+    hits = np.stack([compute_topk_hits(hit_ranks, ks)
+                     for hit_ranks in all_hit_ranks])
+    n_models, n_ks, n_samples = hits.shape
+    hits = hits.reshape(n_models * n_ks, n_samples)
+    batch_size = max(1, MAX_RESAMPLED_ITEMS // (n_models * n_ks * n_samples))
+    resampled = np.concatenate(
+        [hits[:, indices].mean(axis=-1) for indices in iter_resample_indices(
+            n_samples, n_resamples, seed, batch_size)], axis=-1)
+    return hits.mean(axis=-1).reshape(n_models, n_ks),\
+        resampled.reshape(n_models, n_ks, n_resamples)
+
+
+def compute_bootstrap_cis(resampled, confidence=0.95):
+    """ Percentile bootstrap confidence intervals of accuracies
+    Args:
+        - resampled: resampled accuracies (... x n_resamples)
+        - confidence: probability mass of the intervals
+    Returns:
+        - lower and upper bounds of the intervals (...)
+    """
+    alpha = (1.0 - confidence) / 2
+    return np.quantile(resampled, [alpha, 1.0 - alpha], axis=-1)
+
+
+def compute_paired_pvalues(observed_a, observed_b, resampled_a, resampled_b):
+    """ Two-sided paired bootstrap p-values of the accuracy differences
+        between two models resampled identically, i.e., how often resampled
+        differences deviate from the observed one by at least the observed
+        difference (the null hypothesis being a zero difference)
+    Args:
+        - observed_a, observed_b: observed accuracies of both models (n_ks)
+        - resampled_a, resampled_b: their resampled accuracies (same order)
+    Returns:
+        - accuracy differences (a - b) and their p-values (n_ks)
+    """
+    deltas = observed_a - observed_b
+    resampled_deltas = resampled_a - resampled_b
+    n_extremes = (np.abs(resampled_deltas - deltas[:, None])
+                  >= np.abs(deltas[:, None])).sum(axis=-1)
+    n_resamples = resampled_deltas.shape[-1]
+    return deltas, (n_extremes + 1) / (n_resamples + 1)
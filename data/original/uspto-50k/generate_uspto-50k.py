@@ -1,10 +1,12 @@
 import os
-import re
+import sys
 import csv
 from tqdm import tqdm
 from rdkit import Chem
 from rdkit import RDLogger
 RDLogger.DisableLog('rdApp.*')
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from atom_tokenizer import atomwise_tokenizer
 
 
 ORIGINAL_DATA_DIR = os.path.abspath('../original')
@@ -66,17 +68,6 @@ def remove_stereo_info(smiles):
     return smiles
 
 
-def atomwise_tokenizer(smiles):
-    # From https://github.com/pschwllr/MolecularTransformer
-    # Should also work with selfies (thanks to the [])
-    pattern = '(\[[^\]]+]|Br?|Cl?|N|O|S|P|F|I|b|c|n|o|s|p|\(|\)'+\
-              '|\.|=|#|-|\+|\\\\|\/|:|~|@|\?|>|\*|\$|\%[0-9]{2}|[0-9])'
-    regex = re.compile(pattern)
-    tokens = [token for token in regex.findall(smiles)]
-    assert smiles == ''.join(tokens)
-    return ' '.join(tokens)
-    
-
 def canonicalize_smiles(smiles):
     try:
         return Chem.MolToSmiles(Chem.MolFromSmiles(smiles))
@@ -1,128 +1,366 @@
 import os
 import csv
+import sqlite3
+import numpy as np
 import selfies as sf
+from functools import lru_cache
+from contextlib import closing
 from multiprocessing import Pool
 from tqdm import tqdm
 from rdkit import Chem
 from rdkit import RDLogger
 RDLogger.DisableLog('rdApp.*')
+from sample_store import load_samples, write_samples, hash_file
+from bootstrap_stats import bootstrap_topk_accuracies, compute_bootstrap_cis,\
+                            compute_paired_pvalues
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-k', '--ks', nargs='+', default=[1, 3, 5, 10], type=int)
+parser.add_argument('-w', '--workers', default=max(1, os.cpu_count() // 2),
+                    type=int)
+parser.add_argument('-c', '--chunk_size', default=1000, type=int)
+parser.add_argument('-b', '--bootstraps', default=1000, type=int)
+args = parser.parse_args()
 
 
 LOGS_DIR = os.path.abspath('logs')
 DATA_DIR = os.path.abspath('data')
 RESULTS_DIR = os.path.abspath('results')
-KS = [1, 3, 5, 10]
+STANDARD_CACHE_PATH = os.path.join(RESULTS_DIR, 'standard_smiles.sqlite')
+RESULTS_DB_PATH = os.path.join(RESULTS_DIR, 'results.sqlite')
+SQLITE_BATCH_SIZE = 500  # number of strings looked up in one sql query
+STANDARD_MEMO_SIZE = 1 << 18  # number of standardized strings kept per process
+KS = args.ks  # any list of k costs the same, from the same hit ranks
+N_WORKERS = args.workers  # shared by the chunks of all models
+CHUNK_SIZE = args.chunk_size  # samples (gold lines) evaluated by one task
+READ_BLOCK_SIZE = 1 << 22  # bytes read at once when finding line offsets
+N_BOOTSTRAPS = args.bootstraps  # resamples of the samples (0 -> no intervals)
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0  # same resamples for models sharing a test set -> paired
+HIT_MODES = ['strict', 'any', 'all']
+NO_HIT = 0  # hit rank of samples whose predictions never deserve a hit
 MODES = ['test', 'test-50k', 'roundtrip', 'roundtrip-50k']
 SPECS = ['task', 'format', 'token', 'embed', 'augment']
+METRICS = {'top': 'strict', 'lenient': 'any'}  # hit mode of each metric
 HEADERS = SPECS + ['top-%s' % k for k in KS] + ['lenient-%s' % k for k in KS]
+CI_HEADERS = SPECS + ['%s-%s-%s' % (metric, k, bound) for metric in METRICS
+                      for k in KS for bound in ['low', 'high']]
+PAIRED_HEADERS = ['model_a', 'model_b', 'metric', 'k', 'delta', 'p_value']
 
 
 def main():
     os.makedirs(RESULTS_DIR, exist_ok=True)
-    for mode in MODES:
-        evaluate_models(mode)
+    open_standard_cache().close()  # created before workers share it
+    with closing(open_results_db()) as results_db:
+        for mode in MODES:
+            evaluate_models(mode, results_db)
 
 
-def evaluate_models(mode):
-    result_file_path = os.path.join(RESULTS_DIR, 'results_%s.csv' % mode)
-    write_result_line(result_file_path, HEADERS, 'w')  # initialize result file
-    args_to_run = []
+def evaluate_models(mode, results_db):
+    """ Evaluate the models whose predictions or gold changed since they were
+        last evaluated, write their rows in the results database (the parent
+        process being its only writer) and export all rows of this mode to
+        results_<mode>.csv; the samples of all models are split in chunks,
+        evaluated by one pool, so that one large model also uses all workers
+    """
+    models, tasks, n_chunks, chunk_samples = {}, [], {}, {}
     for folder, _, files in os.walk(LOGS_DIR):
-        if '%s_predictions.txt' % mode in files:
-            args_to_run.append((folder, result_file_path, mode))
-    n_cpus_used = max(1, os.cpu_count() // 2)
-    with Pool(n_cpus_used) as pool:
-        pool.map(evaluate_one_model, args_to_run)
-    sort_csv(result_file_path, sort_column_order=[0, 1, 2, 4, 3])
-
-
-def evaluate_one_model(args):
-    folder, write_path, mode = args
-    print('Starting %s for %s' % (folder, mode))
-    pred_path = os.path.join(folder, '%s_predictions.txt' % mode)
+        if '%s_predictions.txt' % mode not in files: continue
+        pred_path = os.path.join(folder, '%s_predictions.txt' % mode)
+        gold_path = get_gold_path(folder, mode)
+        hashes = (hash_file(pred_path), hash_file(gold_path))
+        models[folder] = hashes
+        model_specs = get_model_specs(folder)
+        if is_evaluated(results_db, model_specs, mode, hashes): continue
+        samples = load_samples(pred_path, gold_path, hashes=hashes)
+        if samples is not None:
+            write_model_results(results_db, folder, mode, hashes, samples)
+            continue
+        model_chunks = plan_chunks(pred_path, gold_path)
+        model = (folder, hashes)
+        n_chunks[model], chunk_samples[model] = len(model_chunks), {}
+        tasks.extend((model, i, chunk) for i, chunk in enumerate(model_chunks))
+    
+    # Store the samples and results of a model as soon as its chunks are done
+    with Pool(N_WORKERS) as pool:
+        progress_bar = tqdm(pool.imap_unordered(evaluate_chunk, tasks),
+                            total=len(tasks), desc='Evaluating %s' % mode)
+        for model, i, samples in progress_bar:
+            chunk_samples[model][i] = samples
+            if len(chunk_samples[model]) < n_chunks[model]: continue
+            folder, hashes = model
+            samples = merge_samples(chunk_samples.pop(model))
+            pred_path = os.path.join(folder, '%s_predictions.txt' % mode)
+            write_samples(pred_path, get_gold_path(folder, mode), samples)
+            write_model_results(results_db, folder, mode, hashes, samples)
+    delete_old_models(results_db, mode,
+                      [get_model_specs(folder) for folder in models])
+    if N_BOOTSTRAPS > 0:
+        compare_models(results_db, mode, models)
+    export_results(results_db, mode)
+
+
+def write_model_results(results_db, folder, mode, hashes, samples):
+    model_specs = get_model_specs(folder)
+    rows = []
+    for metric, hit_mode in METRICS.items():
+        hit_ranks = samples['hit_ranks_%s' % hit_mode]
+        accuracies = compute_topk_accuracies(hit_ranks, KS)
+        if N_BOOTSTRAPS > 0:
+            _, resampled = bootstrap_topk_accuracies(
+                [hit_ranks], KS, N_BOOTSTRAPS, BOOTSTRAP_SEED)
+            lows, highs = compute_bootstrap_cis(resampled[0],
+                                                BOOTSTRAP_CONFIDENCE).tolist()
+        else:
+            lows, highs = [None] * len(KS), [None] * len(KS)
+        rows.extend(model_specs + [mode, metric, k, accuracy, low, high]
+                    + list(hashes)
+                    for k, accuracy, low, high in zip(KS, accuracies, lows,
+                                                      highs))
+    write_result_rows(results_db, rows)
+
+
+def compare_models(results_db, mode, models):
+    """ Paired bootstrap tests between all models of the same task whose
+        canonical golds are the same samples, in the same order (whatever
+        their format and tokenization), from their stored hit ranks
+    """
+    folders_by_task = {}
+    for folder in sorted(models):
+        task = get_model_specs(folder)[0]
+        folders_by_task.setdefault(task, []).append(folder)
+    keys = ['golds'] + ['hit_ranks_%s' % hit_mode
+                        for hit_mode in METRICS.values()]
+    rows = []
+    for folders in folders_by_task.values():
+        if len(folders) < 2: continue
+        samples = {folder: load_samples(
+            os.path.join(folder, '%s_predictions.txt' % mode),
+            get_gold_path(folder, mode), keys, models[folder])
+            for folder in folders}
+        test_sets = []  # lists of folders sharing the same canonical golds
+        for folder in folders:
+            if samples[folder] is None: continue
+            for test_set in test_sets:
+                if np.array_equal(samples[test_set[0]]['golds'],
+                                  samples[folder]['golds']):
+                    test_set.append(folder)
+                    break
+            else:
+                test_sets.append([folder])
+        for test_set in test_sets:
+            if len(test_set) < 2: continue
+            rows.extend(compute_paired_rows(mode, test_set, samples))
+    with results_db:  # cheap enough to be computed again at every run
+        results_db.execute('DELETE FROM paired_tests WHERE mode = ?', (mode,))
+        results_db.executemany('INSERT INTO paired_tests VALUES '
+                               '(?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+def compute_paired_rows(mode, folders, samples):
+    rows = []
+    for metric, hit_mode in METRICS.items():
+        # All models resampled at once, pairs only subtract accuracies
+        observed, resampled = bootstrap_topk_accuracies(
+            [samples[f]['hit_ranks_%s' % hit_mode] for f in folders],
+            KS, N_BOOTSTRAPS, BOOTSTRAP_SEED)
+        for a, folder_a in enumerate(folders):
+            for b, folder_b in enumerate(folders[a + 1:], start=a + 1):
+                deltas, p_values = compute_paired_pvalues(
+                    observed[a], observed[b], resampled[a], resampled[b])
+                rows.extend([mode, '/'.join(get_model_specs(folder_a)),
+                             '/'.join(get_model_specs(folder_b)), metric,
+                             k, delta, p] for k, delta, p
+                            in zip(KS, deltas.tolist(), p_values.tolist()))
+    return rows
+
+
+def get_gold_path(folder, mode):
     gold_dir = os.path.split(folder)[0].replace(LOGS_DIR, DATA_DIR)
     if not 'noreag' in folder and 'roundtrip' in mode:  # only predict product
         gold_dir = gold_dir.replace('reactant-pred', 'reactant-pred-noreag')
     gold_flag = 'src' if 'roundtrip' in mode else 'tgt'
     mode_flag = '-50k' if '50k' in mode else ''
-    gold_path = os.path.join(gold_dir, '%s-test%s.txt' % (gold_flag, mode_flag))
-    compute_model_topk_accuracy(write_path, pred_path, gold_path, mode)
+    return os.path.join(gold_dir, '%s-test%s.txt' % (gold_flag, mode_flag))
 
 
-def compute_model_topk_accuracy(write_path, pred_path, gold_path, mode):
-    # Retrieve model data and initialize parameters
-    all_preds, all_golds = read_pred_and_data(pred_path, gold_path)
-    n_preds_per_gold = len(all_preds) // len(all_golds)
-    topk_hits = {k: [] for k in KS}  # for strict accuracy
-    lenk_hits = {k: [] for k in KS}  # for lenient accuracy
-    
-    # Compute all top-k accuracies for this model
-    progress_bar = tqdm(list(enumerate(all_golds)))
-    for i, gold in progress_bar:
-        progress_bar.set_description('Computing %s accuracy' % mode)
-        preds = all_preds[i * n_preds_per_gold:(i + 1) * n_preds_per_gold]
-        preds, gold = standardize_molecules(preds, gold, pred_path)
-        [topk_hits[k].append(
-            compute_topk_hit(preds[:k], gold, mode='strict')) for k in KS]
-        [lenk_hits[k].append(
-            compute_topk_hit(preds[:k], gold, mode='any')) for k in KS]
-    
-    # Write results for this model in a common file
-    _, task, format, token, augment, embed, _ =\
-        pred_path.split(LOGS_DIR)[-1].split(os.path.sep)
+def get_model_specs(folder):
+    # logs/<task>/<format>/<token>/<augment>/<embed> -> values of SPECS
+    _, task, format, token, augment, embed =\
+        folder.split(LOGS_DIR)[-1].split(os.path.sep)
     augment = 'x%02i' % int(augment.split('x')[-1])  # format for sorting
-    model_specs = [task, format, token, embed, augment]
-    topk_data = [sum(v) / len(v) for v in topk_hits.values()]
-    lenk_data = [sum(v) / len(v) for v in lenk_hits.values()]
-    result_line = model_specs + topk_data + lenk_data
-    write_result_line(write_path, result_line, 'a')
+    return [task, format, token, embed, augment]
+
+
+def plan_chunks(pred_path, gold_path):
+    """ Split the samples of a model in chunks of CHUNK_SIZE gold lines and
+        their n-best prediction lines, given as byte ranges of both files
+    """
+    gold_offsets = find_line_offsets(gold_path)
+    pred_offsets = find_line_offsets(pred_path)
+    n_golds = len(gold_offsets) - 1
+    n_preds_per_gold = (len(pred_offsets) - 1) // n_golds
+    chunks = []
+    for start in range(0, n_golds, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, n_golds)
+        pred_range = (int(pred_offsets[start * n_preds_per_gold]),
+                      int(pred_offsets[end * n_preds_per_gold]))
+        gold_range = (int(gold_offsets[start]), int(gold_offsets[end]))
+        chunks.append((pred_path, pred_range, gold_path, gold_range,
+                       n_preds_per_gold))
+    return chunks
+
 
+def find_line_offsets(path):
+    # Byte offsets of all lines of a file, followed by its size, in one pass
+    offsets, position = [np.zeros(1, dtype=np.int64)], 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+            newlines = np.flatnonzero(
+                np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            offsets.append(newlines.astype(np.int64) + position + 1)
+            position += len(block)
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != position:  # last line without a final newline
+        offsets = np.append(offsets, np.int64(position))
+    return offsets
 
-def write_result_line(file_path, content, write_or_append):
-    with open(file_path, write_or_append) as f:
-        writer = csv.writer(f); writer.writerow(content)
 
+def evaluate_chunk(task):
+    model, i, (pred_path, pred_range, gold_path, gold_range,
+               n_preds_per_gold) = task
+    all_preds = read_lines(pred_path, *pred_range)
+    all_golds = read_lines(gold_path, *gold_range)
+    smiles_format = 'selfies' if 'selfies' in pred_path else 'smiles'
+    samples = compute_samples(all_preds, all_golds, n_preds_per_gold,
+                              smiles_format)
+    return model, i, samples
 
-def read_pred_and_data(pred_path, gold_path):
-    with open(pred_path, 'r') as p: all_preds = p.readlines()
-    with open(gold_path, 'r') as g: all_golds = g.readlines()
-    all_preds = [''.join(p.strip().split()) for p in all_preds]
-    all_golds = [''.join(g.strip().split()) for g in all_golds]
-    return all_preds, all_golds
 
+def read_lines(path, start, end):
+    # Only the lines of one chunk are read, each process reading its own
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode('utf-8').split('\n')
+    if lines[-1] == '': lines.pop()  # after the last newline
+    return [''.join(line.strip().split()) for line in lines]
 
-def compute_topk_hit(preds, gold, mode='strict'):
-    """ Compute whether a list of top-k best predictions contains a correct one
+
+def compute_samples(all_preds, all_golds, n_preds_per_gold, smiles_format):
+    """ Compute the canonical predictions and gold, the hit ranks and the
+        molecule counts of some samples of a model (see sample_store.py)
+    """
+    standard = get_standard_smiles(set(all_preds) | set(all_golds),
+                                   smiles_format)
+    hit_ranks = {hit_mode: np.empty(len(all_golds), dtype=np.int64)
+                 for hit_mode in HIT_MODES}
+    
+    # Compute the first hit rank of all samples, for all hit modes at once
+    for i, gold in enumerate(all_golds):
+        preds = all_preds[i * n_preds_per_gold:(i + 1) * n_preds_per_gold]
+        preds, gold = [standard[p] for p in preds], standard[gold]
+        for hit_mode, rank in compute_hit_ranks(preds, gold).items():
+            hit_ranks[hit_mode][i] = rank
+    
+    # Gather everything later analyses need, without any rdkit call
+    standard_preds = np.array([standard[p] for p in all_preds], dtype=str)\
+        .reshape(len(all_golds), n_preds_per_gold)
+    standard_golds = np.array([standard[g] for g in all_golds], dtype=str)
+    samples = {'preds': standard_preds,
+               'golds': standard_golds,
+               'n_pred_mols': count_molecules(standard_preds),
+               'n_gold_mols': count_molecules(standard_golds)}
+    samples.update({'hit_ranks_%s' % hit_mode: ranks
+                    for hit_mode, ranks in hit_ranks.items()})
+    return samples
+
+
+def merge_samples(chunk_samples):
+    # Samples of all chunks of a model, in the order of the model files
+    chunks = [chunk_samples[i] for i in range(len(chunk_samples))]
+    return {key: np.concatenate([chunk[key] for chunk in chunks])
+            for key in chunks[0]}
+
+
+def compute_hit_ranks(preds, gold):
+    """ Compute, in one pass, the first rank at which the k best predictions
+        of a sample deserve a hit, for all hit modes: 'strict' (same unique
+        molecules), 'all' (all predicted molecules in gold) and 'any' (some
+        predicted molecule in gold)
     Args:
-        - preds: list of k best predictions, strings of '.'- separated molecules
+        - preds: list of best predictions, strings of '.'- separated molecules
         - gold: ground truth basis for hit computation (same type of string)
-        - mode: whether all or any molecule(s) should be correctly predicted
+    Returns:
+        - dict mapping hit modes to 1-based ranks (NO_HIT if no hit)
+    """
+    gold_set = set(gold.split('.'))
+    hit_ranks = {hit_mode: NO_HIT for hit_mode in HIT_MODES}
+    for rank, pred in enumerate(preds, start=1):
+        pred_set = set(pred.split('.'))
+        hit_fns = {'strict': pred_set.__eq__,
+                   'all': pred_set.issubset,
+                   'any': lambda gold_set: not pred_set.isdisjoint(gold_set)}
+        for hit_mode, hit_fn in hit_fns.items():
+            if hit_ranks[hit_mode] == NO_HIT and hit_fn(gold_set):
+                hit_ranks[hit_mode] = rank
+        if hit_ranks['strict'] != NO_HIT: break  # strict hit -> all modes hit
+    return hit_ranks
+
+
+def count_molecules(strings):
+    # Number of '.'-separated molecules (duplicates included) of each string
+    return np.char.count(strings, '.') + 1
+
+
+def compute_topk_accuracies(hit_ranks, ks):
+    # Number of samples with a hit at rank k or better, for all k at once
+    n_hits_by_rank = np.bincount(hit_ranks, minlength=max(ks) + 1)
+    n_hits_by_rank[NO_HIT] = 0
+    n_hits_at = np.cumsum(n_hits_by_rank)
+    return (n_hits_at[np.asarray(ks)] / len(hit_ranks)).tolist()
+
+
+def get_standard_smiles(strings, smiles_format):
+    """ Map predicted or gold strings to canonical smiles, only standardizing
+        the strings that were not already seen by any model or previous run
+        (strings that rdkit or selfies cannot read are also stored, as is)
     """
-    if mode == 'all':
-        # Requirement: all gold molecules are in the model prediction
-        hit_fn = lambda gold, pred: all([g in pred for g in gold])
-    elif mode == 'any':
-        # Requirement: any of the gold molecules are in the model prediction
-        hit_fn = lambda gold, pred: any([g in pred for g in gold])
-    elif mode == 'strict':
-         # Requirement: exact match between gold and prediction molecules
-         hit_fn = lambda gold, pred: sorted(pred) == sorted(gold)
-    else:
-        raise ValueError('Incorrect mode for compute hit function')
-    # Requirement: at least one of preds (list of length k) deserves a hit
-    return any([hit_fn(remove_duplicates(pred.split('.')),
-                       remove_duplicates(gold.split('.'))) for pred in preds])
-
-
-def standardize_molecules(preds, gold, pred_path):
-    if 'selfies' in pred_path:
-        # preds = [sf.decoder(p) for p in preds]
-        # gold = sf.decoder(gold)
-        preds = [create_smiles_from_selfies(p) for p in preds]
-        gold = create_smiles_from_selfies(gold)
-    preds = [canonicalize_smiles(p) for p in preds]
-    gold = canonicalize_smiles(gold)
-    return preds, gold
+    strings = list(strings)
+    standard = {}
+    with closing(open_standard_cache()) as standard_cache:
+        for i in range(0, len(strings), SQLITE_BATCH_SIZE):
+            batch = strings[i:i + SQLITE_BATCH_SIZE]
+            query = 'SELECT raw, standard FROM standard_smiles '\
+                    'WHERE format = ? AND raw IN (%s)'\
+                    % ', '.join(['?'] * len(batch))
+            standard.update(standard_cache.execute(query,
+                                                   [smiles_format] + batch))
+        new_standard = [(smiles_format, s, standardize_smiles(s, smiles_format))
+                        for s in strings if s not in standard]
+        if len(new_standard) > 0:
+            with standard_cache:  # other workers may have added them since
+                standard_cache.executemany(
+                    'INSERT OR IGNORE INTO standard_smiles VALUES (?, ?, ?)',
+                    new_standard)
+    standard.update({raw: std for _, raw, std in new_standard})
+    return standard
+
+
+def open_standard_cache():
+    # Shared by all evaluation workers, which may write it at the same time
+    standard_cache = sqlite3.connect(STANDARD_CACHE_PATH, timeout=600)
+    standard_cache.execute('PRAGMA journal_mode=WAL')
+    standard_cache.execute('CREATE TABLE IF NOT EXISTS standard_smiles '
+                           '(format TEXT NOT NULL, raw TEXT NOT NULL, '
+                           'standard TEXT NOT NULL, PRIMARY KEY (format, raw))')
+    return standard_cache
+
+
+@lru_cache(maxsize=STANDARD_MEMO_SIZE)
+def standardize_smiles(smiles, smiles_format):
+    if smiles_format == 'selfies':
+        smiles = create_smiles_from_selfies(smiles)
+    return canonicalize_smiles(smiles)
 
 
 def canonicalize_smiles(smiles):
@@ -147,23 +385,103 @@ def create_smiles_from_selfies(selfies):
         return '.'.join(smiles_mols)
 
 
-def remove_duplicates(sequence):
-    seen = set()
-    seen_add = seen.add
-    return [x for x in sequence if not (x in seen or seen_add(x))]
+def open_results_db():
+    # One row per model, mode, metric and k, written by the parent process only
+    results_db = sqlite3.connect(RESULTS_DB_PATH)
+    columns = [row[1] for row in
+               results_db.execute('PRAGMA table_info(results)')]
+    if len(columns) > 0 and 'ci_low' not in columns:  # written before intervals
+        results_db.execute('DROP TABLE results')
+    results_db.execute('CREATE TABLE IF NOT EXISTS results '
+                       '(task TEXT NOT NULL, format TEXT NOT NULL, '
+                       'token TEXT NOT NULL, embed TEXT NOT NULL, '
+                       'augment TEXT NOT NULL, mode TEXT NOT NULL, '
+                       'metric TEXT NOT NULL, k INTEGER NOT NULL, '
+                       'accuracy REAL NOT NULL, ci_low REAL, ci_high REAL, '
+                       'pred_hash TEXT NOT NULL, gold_hash TEXT NOT NULL, '
+                       'PRIMARY KEY (task, format, token, embed, augment, '
+                       'mode, metric, k))')
+    results_db.execute('CREATE INDEX IF NOT EXISTS results_by_mode '
+                       'ON results (mode, metric, k)')
+    results_db.execute('CREATE TABLE IF NOT EXISTS paired_tests '
+                       '(mode TEXT NOT NULL, model_a TEXT NOT NULL, '
+                       'model_b TEXT NOT NULL, metric TEXT NOT NULL, '
+                       'k INTEGER NOT NULL, delta REAL NOT NULL, '
+                       'p_value REAL NOT NULL, PRIMARY KEY (mode, model_a, '
+                       'model_b, metric, k))')
+    return results_db
+
+
+def is_evaluated(results_db, model_specs, mode, hashes):
+    # Up to date if all ks (and intervals) were computed from the same files
+    query = 'SELECT k, ci_low, pred_hash, gold_hash FROM results '\
+            'WHERE task = ? AND format = ? AND token = ? AND embed = ? '\
+            'AND augment = ? AND mode = ?'
+    rows = results_db.execute(query, model_specs + [mode]).fetchall()
+    return all(tuple(row[2:]) == hashes for row in rows)\
+        and set(KS) <= {row[0] for row in rows}\
+        and (N_BOOTSTRAPS == 0 or all(row[1] is not None for row in rows))
 
 
-def sort_csv(filepath, sort_column_order):
-    with open(filepath, "r") as f:
-        reader = csv.reader(f)
-        headers = next(reader)
-        rows = list(reader)
+def write_result_rows(results_db, rows):
+    # Replace all rows of one model and mode, leaving other models untouched
+    with results_db:
+        results_db.execute('DELETE FROM results WHERE task = ? AND format = ? '
+                           'AND token = ? AND embed = ? AND augment = ? '
+                           'AND mode = ?', rows[0][:6])
+        results_db.executemany('INSERT INTO results VALUES '
+                               '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               rows)
 
-    rows.sort(key=lambda row: [row[column] for column in sort_column_order])   
-    with open(filepath, "w", newline="") as f:
+
+def delete_old_models(results_db, mode, models):
+    # Rows of models whose predictions were removed since they were evaluated
+    query = 'SELECT DISTINCT task, format, token, embed, augment FROM results '\
+            'WHERE mode = ?'
+    old_models = [list(row) for row in results_db.execute(query, (mode,))
+                  if list(row) not in models]
+    with results_db:
+        results_db.executemany('DELETE FROM results WHERE task = ? AND '
+                               'format = ? AND token = ? AND embed = ? AND '
+                               'augment = ? AND mode = ?',
+                               [model + [mode] for model in old_models])
+
+
+def export_results(results_db, mode):
+    """ Write the results of one mode as csv files, with one row per model
+        and one column per metric and k (see HEADERS, CI_HEADERS), sorted by
+        model specs, and with one row per paired test (see PAIRED_HEADERS)
+    """
+    query = 'SELECT task, format, token, embed, augment, metric, k, '\
+            'accuracy, ci_low, ci_high FROM results WHERE mode = ? '\
+            'ORDER BY task, format, token, augment, embed'
+    table = {}
+    for *model_specs, metric, k, accuracy, low, high in results_db.execute(
+            query, (mode,)):
+        table.setdefault(tuple(model_specs), {})[(metric, k)] =\
+            (accuracy, low, high)
+    file_path = os.path.join(RESULTS_DIR, 'results_%s.csv' % mode)
+    ci_file_path = os.path.join(RESULTS_DIR, 'results_%s_ci.csv' % mode)
+    with open(file_path, 'w', newline='') as f,\
+         open(ci_file_path, 'w', newline='') as ci_f:
+        writer, ci_writer = csv.writer(f), csv.writer(ci_f)
+        writer.writerow(HEADERS)
+        ci_writer.writerow(CI_HEADERS)
+        for model_specs, values in table.items():
+            values = [values.get((metric, k), (None,) * 3)
+                      for metric in METRICS for k in KS]
+            writer.writerow(list(model_specs) + [v[0] for v in values])
+            ci_writer.writerow(list(model_specs)
+                               + [bound for v in values for bound in v[1:]])
+    
+    paired_file_path = os.path.join(RESULTS_DIR, 'paired_tests_%s.csv' % mode)
+    query = 'SELECT model_a, model_b, metric, k, delta, p_value '\
+            'FROM paired_tests WHERE mode = ? ORDER BY model_a, model_b, '\
+            'metric DESC, k'
+    with open(paired_file_path, 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(headers)
-        writer.writerows(rows)
+        writer.writerow(PAIRED_HEADERS)
+        writer.writerows(results_db.execute(query, (mode,)))
 
 
 if __name__ == '__main__':
@@ -79,6 +79,12 @@ def do_plot():
     print('- Plotted figure 2 at %s!' % FILE_DIR)
 
 
+def get_input_paths():
+    # Files read by do_plot, to know when the figure must be plotted again
+    return [os.path.join(DATA_DIR, 'results_test%s.csv' % appendix)
+            for appendix in ['', '-50k']]
+
+
 def plot_one_figure(topk, appendix=''):
     data_path = os.path.join(DATA_DIR, 'results_test%s.csv' % appendix)
     save_path = os.path.join(FILE_DIR, 'fig2%s-top%s.png' % (appendix, topk))
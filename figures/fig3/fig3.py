@@ -58,6 +58,12 @@ def do_plot():
     print('- Plotted figure 3 at %s!' % FILE_DIR)
 
 
+def get_input_paths():
+    # Files read by do_plot, to know when the figure must be plotted again
+    return [os.path.join(DATA_DIR, 'results_%s%s.csv' % (mode, appendix))
+            for mode in ['test', 'roundtrip'] for appendix in ['', '-50k']]
+
+
 def plot_one_figure(appendix=''):
     reactant_file = os.path.join(DATA_DIR, 'results_test%s.csv' % appendix)
     roundtrip_file = os.path.join(DATA_DIR, 'results_roundtrip%s.csv' % appendix)
@@ -1,16 +1,15 @@
 import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patheffects as pe
 import pandas as pd
-import selfies as sf
-import pickle
-from tqdm.auto import trange
 from collections import defaultdict
-from typing import List, Tuple, Dict, Union
-from rdkit import Chem
-from rdkit import RDLogger
-RDLogger.DisableLog('rdApp.*')
+from typing import List, Tuple, Dict
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)  # also run as python figures/fig4/fig4.py
+from sample_store import load_samples, sample_store_path
 
 
 FILE_DIR = os.path.split(__file__)[0]
@@ -36,25 +35,12 @@ TOPKS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
 LABEL_FONTSIZE = 16
 TICK_FONTSIZE = 13
 FOLDS = [1, 2, 5, 10, 20]
-LOAD_DATA = False  # put back to False!
 
 
 def do_plot():
     for fold in FOLDS:
-        data_path = os.path.join(FILE_DIR, 'fig45-x%s_data.pickle' % fold)
-        
         # Load predictions and true labels and cluster by number of true reagents
-        if LOAD_DATA:
-            with open(data_path, 'rb') as f:
-                clusters = pickle.load(f)
-        else:
-            pred_path = PRED_PATH.replace('x1', 'x%s' % fold)
-            gold_path = GOLD_PATH.replace('x1', 'x%s' % fold)
-            predictions = load_reagents(pred_path, fold, max(TOPKS))
-            labels = load_reagents(gold_path, fold, 1)
-            clusters = cluster_by_num_reagents(labels, predictions)
-            with open(data_path, 'wb') as f:
-                pickle.dump(clusters, f)
+        clusters = load_clusters(fold)
                 
         # Compute accuracy as a function of number of true reagents
         matrix = topk_accuracy_matrix(clusters)
@@ -66,105 +52,49 @@ def do_plot():
     print('- Plotted figure 4 at %s!' % FILE_DIR)
 
 
-def standardize_molecules(sample_line: str, fmt: str = 'smiles') -> List[str]:
+def get_input_paths() -> List[str]:
     """
-    Clean and standardize molecules.
-
-    Parameters:
-        sample_line (str): The string representation of molecules.
-        fmt (str): The format of the input molecule string. 
-            'smiles' (default) or 'selfies'
-
-    Returns:
-        A list of standardized and cleaned molecules.
+    Files read by do_plot, to know when the figure must be plotted again.
     """
-    sample_line = ''.join(sample_line.strip().split())
-    if fmt == 'selfies':
-        sample_line = create_smiles_from_selfies(sample_line)
-    sample_line = canonicalize_smiles(sample_line)
-    return sorted(sample_line.split('.'))
+    input_paths = []
+    for fold in FOLDS:
+        pred_path, gold_path = get_fold_paths(fold)
+        input_paths.extend([pred_path, gold_path, sample_store_path(pred_path)])
+    return input_paths
 
 
-def canonicalize_smiles(smiles: str) -> str:
+def get_fold_paths(fold: int) -> Tuple[str, str]:
     """
-    Convert a SMILES string to its canonical form.
-
-    Parameters:
-        smiles (str): A SMILES string.
-
-    Returns:
-        The canonical form of the SMILES string.
-    """
-    try:
-        return Chem.MolToSmiles(Chem.MolFromSmiles(smiles))
-    except:
-        return smiles
-
-
-def create_smiles_from_selfies(selfies: str) -> Union[str, List[str]]:
+    Paths of the reagent predictions and true labels of one augmentation fold.
     """
-    Convert a Selfies string to its SMILES representation.
+    return PRED_PATH.replace('x1', 'x%s' % fold),\
+        GOLD_PATH.replace('x1', 'x%s' % fold)
 
-    Parameters:
-        selfies (str): A Selfies string.
 
-    Returns:
-        The SMILES representation of the Selfies string. 
-        If the input is a single line, it will return a string
-        If the input is multiple line, it will return list of strings
+def load_clusters(fold: int) -> Dict[int, List[Tuple[List[List[str]],
+                                                     List[List[str]]]]]:
     """
-    try:
-        return sf.decoder(selfies)
-    except sf.DecoderError:
-        selfies_mols = selfies.split('.')
-        smiles_mols = []
-        for selfies_mol in selfies_mols:
-            try:
-                smiles_mol = sf.decoder(selfies_mol)
-            except sf.DecoderError:
-                smiles_mol = '?'
-            smiles_mols.append(smiles_mol)
-        return smiles_mols
-
-
-def load_reagents(path: str,
-                  fold: int,
-                  num_pred_per_instance: int = 1,
-                  standardize: bool = True) -> List[List[str]]:
-    """
-    Load reagent strings from a file and chunk them into a list of lists
-    of equal size.
+    Load canonical reagent predictions and true labels from the per-sample
+    results stored by evaluate_all_models.py, and cluster them by number of
+    true reagents (see cluster_by_num_reagents).
 
     Parameters:
-        path (str): The path to the file containing the reagent strings.
         fold (int): Level of data augmentation being loaded
-        num_pred_per_instance (int): The number of reagent strings to include
-        in each sublist. Default one.
-        standardize (bool): If returned reagent should be standardized or not.
-        Default True.
 
     Returns:
-        A list of lists of SMILES strings, where each sublist contains 
-        `num_pred_per_instance` SMILES strings.
-    """
-    loading_descr = 'Loading x%s data for figures 4 and 5' % fold
-    with open(path, "r") as p:
-        lines = p.read().splitlines()
-    if standardize:
-        return [[standardize_molecules(j)
-                for j in lines[i:i + num_pred_per_instance]]
-                for i in trange(0,
-                               len(lines),
-                               num_pred_per_instance,
-                               desc=loading_descr,
-                               leave=False)]
-    else:
-        return [lines[i:i + num_pred_per_instance]
-                for i in trange(0,
-                                len(lines),
-                                num_pred_per_instance,
-                                desc=loading_descr,
-                                leave=False)]
+        The clusters of true labels and predictions, where the molecules of
+        each label or prediction are sorted.
+    """
+    pred_path, gold_path = get_fold_paths(fold)
+    samples = load_samples(pred_path, gold_path)
+    if samples is None:
+        raise FileNotFoundError(
+            'Per-sample results of %s missing or out of date.'
+            ' You must run evaluate_all_models.py first' % pred_path)
+    labels = [[sorted(gold.split('.'))] for gold in samples['golds']]
+    predictions = [[sorted(pred.split('.')) for pred in preds[:max(TOPKS)]]
+                   for preds in samples['preds'].tolist()]
+    return cluster_by_num_reagents(labels, predictions)
 
 
 def cluster_by_num_reagents(leading_lists: List[List[List[str]]],
@@ -1,8 +1,14 @@
 import os
+import sys
+import numpy as np
 import matplotlib.pyplot as plt
-import pickle
 from itertools import chain
-from typing import List, Tuple, Union
+from typing import Dict, List, Sequence, Tuple, Union
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)  # also run as python figures/fig5/fig5.py
+from figures.fig4.fig4 import load_clusters, get_fold_paths
+from sample_store import sample_store_path
 
 
 FILE_DIR = os.path.split(__file__)[0]
@@ -46,20 +52,119 @@ BBOX_PARAMS = {
 
 def do_plot():
     # Load predictions and true labels and cluster by number of true reagents
-    try:
-        data_path = os.path.join(FILE_DIR, '..', 'fig4', 'fig45-x1_data.pickle')
-        with open(data_path, 'rb') as f:
-            clusters = pickle.load(f)
-    except FileNotFoundError:
-        raise FileNotFoundError(
-            'Data for figures 4 and 5 not generated yet.\
-             You must set LOAD_DATA to False in figures/fig4/fig4.py')
+    clusters = load_clusters(fold=1)
     
     # Plot figure 5
     fig5_path = os.path.join(FILE_DIR, 'fig5.png')
     plot_figure_5(clusters, fig5_path, TOPKS)
     print('- Plotted figure 5 at %s!' % FILE_DIR)
+
+
+def get_input_paths():
+    # Files read by do_plot, to know when the figure must be plotted again
+    pred_path, gold_path = get_fold_paths(1)
+    fig4_path = os.path.join(FILE_DIR, '..', 'fig4', 'fig4.py')  # clusters
+    return [pred_path, gold_path, sample_store_path(pred_path), fig4_path]
+    
+
+def intern_molecules(clusters: dict) -> Dict[str, int]:
+    """
+    Map every molecule of the true labels and predictions of all clusters to
+    an integer id, so that molecules are only compared as integers
+    
+    Parameters:
+        clusters: data samples and predictions, by # of reagents
+    """
+    mol_ids = {}
+    for cluster in clusters.values():
+        for y_true, y_hat in cluster:
+            for mols in chain(y_true, y_hat):
+                for mol in mols:
+                    mol_ids.setdefault(mol, len(mol_ids))
+    return mol_ids
+
+
+def count_topk_matches(cluster: List[Union[Tuple[List[List[str]]],
+                                           List[List[str]]]],
+                       mol_ids: Dict[str, int]) -> Dict[str, np.ndarray]:
+    """
+    Count predicted and correctly predicted molecules of a cluster within the
+    top-k predictions, for all k at once (cumulative counts over ranks)
+    
+    Parameters:
+        cluster: data samples and predictions for one particular # of reagents
+        mol_ids: molecule ids of intern_molecules
+    
+    Returns:
+        Counts at index k (k = 0 to the number of predictions per sample),
+        summed over samples: 'list_predicted' and 'list_tp' count predicted
+        molecules (duplicates included) and the ones in the true label,
+        'set_predicted' and 'set_tp' the same for unique molecules, while
+        'true' is the number of true molecules (duplicates included)
+    """
+    # One entry per predicted molecule: (sample, molecule) key and rank
+    pred_keys, ranks, true_keys, n_true = [], [], [], 0
+    for i, (y_true, y_hat) in enumerate(cluster):
+        for rank, preds in enumerate(y_hat, start=1):
+            pred_keys.extend((i, mol_ids[mol]) for mol in preds)
+            ranks.extend([rank] * len(preds))
+        true_mols = [mol for chemeq in y_true for mol in chemeq]
+        true_keys.extend((i, mol_ids[mol]) for mol in true_mols)
+        n_true += len(true_mols)
+    max_rank = max([len(y_hat) for _, y_hat in cluster] + [0])
+    to_int = lambda keys: np.array([i * len(mol_ids) + m for i, m in keys],
+                                   dtype=np.int64)
+    pred_keys, true_keys = to_int(pred_keys), to_int(true_keys)
+    ranks = np.array(ranks, dtype=np.int64)
+    
+    # Entries are sorted by sample and rank: first occurrences are unique ones
+    is_true = np.isin(pred_keys, true_keys)
+    is_first = np.zeros(len(pred_keys), dtype=bool)
+    is_first[np.unique(pred_keys, return_index=True)[1]] = True
+    count_at = lambda mask: np.cumsum(np.bincount(ranks[mask],
+                                                  minlength=max_rank + 1))
+    return {'list_predicted': count_at(np.ones(len(ranks), dtype=bool)),
+            'list_tp': count_at(is_true),
+            'set_predicted': count_at(is_first),
+            'set_tp': count_at(is_first & is_true),
+            'true': n_true}
+
+
+def topk_score_curves(cluster: List[Union[Tuple[List[List[str]]],
+                                          List[List[str]]]],
+                      ks: Sequence[int],
+                      strategy: str = 'set',
+                      mol_ids: Dict[str, int] = None)\
+                      -> Tuple[List[float], List[float], List[float]]:
+    """
+    Compute topk precision, recall and f1-score for a cluster of instances,
+    for several values of k at once
+    
+    Parameters:
+        cluster: data samples and predictions for one particular # of reagents
+        ks: numbers of top predictions to consider as correct
+        strategy: 'set' to count unique molecules of the top-k predictions,
+            'list' to count all of them
+        mol_ids: molecule ids of intern_molecules (computed if not given)
     
+    Returns:
+        Precisions, recalls and f1-scores, one value per k
+    """
+    if strategy not in ['list', 'set']:
+        raise ValueError('Invalid strategy to compute true positives')
+    if mol_ids is None:
+        mol_ids = intern_molecules({0: cluster})
+    counts = count_topk_matches(cluster, mol_ids)
+    ks = np.minimum(ks, len(counts['list_predicted']) - 1)  # k > n_preds
+    n_tp = counts['%s_tp' % strategy][ks]
+    n_predicted = counts['%s_predicted' % strategy][ks]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = n_tp / n_predicted
+        recall = n_tp / counts['true']
+        f1 = np.where(precision + recall == 0, 0.0,
+                      2 * precision * recall / (precision + recall))
+    return precision.tolist(), recall.tolist(), f1.tolist()
+
 
 def topk_scores(cluster: List[Union[Tuple[List[List[str]]], List[List[str]]]],
                 k: int,
@@ -71,29 +176,8 @@ def topk_scores(cluster: List[Union[Tuple[List[List[str]]], List[List[str]]]],
         cluster: data samples and predictions for one particular # of reagents
         k: number of top predictions to consider as correct
     """
-    n_tp, n_predicted, n_true = 0, 0, 0
-    for y_true, y_hat in cluster:
-        pred_mols = [mol for preds in y_hat[:k] for mol in preds]
-        true_mols = [mol for chemeq in y_true for mol in chemeq]
-        
-        if strategy == 'list':
-            n_tp += len([c for c in pred_mols if c in true_mols])
-            n_predicted = len(pred_mols)
-        elif strategy == 'set':
-            n_tp += len(set(pred_mols).intersection(set(true_mols)))
-            n_predicted += len(set(pred_mols))
-        else:
-            raise ValueError('Invalid strategy to compute true positives')
-        n_true += len(true_mols)
-    
-    precision = n_tp / n_predicted
-    recall = n_tp / n_true
-    if precision + recall == 0:
-        f1 = 0
-    else:
-        f1 = 2 * (precision * recall) / (precision + recall)
-    
-    return precision, recall, f1
+    return tuple(scores[0] for scores
+                 in topk_score_curves(cluster, [k], strategy))
 
 
 def plot_sample_counts(ax, clusters):
@@ -128,8 +212,7 @@ def plot_sample_counts(ax, clusters):
     return n_samples, n_unique_reagents
 
 
-def plot_rec_prec_f1(ax, clusters, at_k, n_samples):
-    scores = [topk_scores(clusters[i], at_k) for i in range(1, 13)]
+def plot_rec_prec_f1(ax, scores, at_k, n_samples):
     prec, rec, f1 = [[s[i] for s in scores] for i in range(3)]
     avg_prec = sum([p * n / sum(n_samples) for p, n in zip(prec, n_samples)])
     avg_rec = sum([r * n / sum(n_samples) for r, n in zip(rec, n_samples)])
@@ -155,13 +238,18 @@ def plot_rec_prec_f1(ax, clusters, at_k, n_samples):
 
 
 def plot_figure_5(clusters, save_path, topks, figsize=(9, 9)):
-    for topk in topks:
+    # Scores of all clusters and all k, from one pass over each cluster
+    mol_ids = intern_molecules(clusters)
+    curves = [topk_score_curves(clusters[n], topks, mol_ids=mol_ids)
+              for n in REAGENTS_PER_REACTION]
+    for i, topk in enumerate(topks):
         fig = plt.figure(figsize=figsize)
         gs = fig.add_gridspec(2, 1, hspace=0.3)
         ax1 = fig.add_subplot(gs[0, 0])
         ax2 = fig.add_subplot(gs[1, 0])
         n_samples, _ = plot_sample_counts(ax2, clusters)
-        plot_rec_prec_f1(ax1, clusters, topk, n_samples)
+        scores = [[values[i] for values in curve] for curve in curves]
+        plot_rec_prec_f1(ax1, scores, topk, n_samples)
         plt.savefig(save_path.replace('.', '-@%s.' % topk),
                     bbox_inches='tight',
                     dpi=300)
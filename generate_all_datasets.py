@@ -1,19 +1,38 @@
 import os
-import re
 import json
 import random
+import hashlib
+import shutil
+import sqlite3
+import numpy as np
 import selfies as sf
 import warnings
+from functools import lru_cache
+from contextlib import closing
+from collections import namedtuple, deque
+from itertools import islice
+from multiprocessing import Pool
 warnings.filterwarnings('ignore', category=UserWarning)
 from tqdm import tqdm
 from rdkit import Chem
 from rdkit import RDLogger
 RDLogger.DisableLog('rdApp.*')
 from SmilesPE.tokenizer import SPE_Tokenizer
-from gensim.models import Word2Vec
+from gensim.models import Word2Vec, KeyedVectors
+from atom_tokenizer import atomwise_tokenizer, tokenize_many
 import argparse
 parser = argparse.ArgumentParser()
-parser.add_argument('-r', '--reduce', default=1.0, type=float)
+parser.add_argument('-r', '--reduce', default=1.0, type=float,
+                    help='fraction of the training reactions to use; training'
+                         ' files are still written in full, plus a '
+                         'lines-train-r<reduce>.npy file with the lines of '
+                         'the reduced set, which only takes effect through '
+                         'the path_lines of write_train_configs.py --reduce')
+parser.add_argument('-w', '--workers', default=1, type=int)
+parser.add_argument('-n', '--nested', action='store_true')
+parser.add_argument('-b', '--binary', action='store_true')
+parser.add_argument('-i', '--index', action='store_true')
+parser.add_argument('-t', '--tasks', nargs='+', default=None)
 args = parser.parse_args()
 
 
@@ -26,62 +45,135 @@ TASKS = [
     'reagent-pred'
 ]
 USPTO_50K_TASKS = [t for t in TASKS if t != 'reagent-pred']
+SELECTED_TASKS = args.tasks or TASKS  # other tasks' datasets are left as is
 FOLDS = [1, 2, 5, 10, 20]
 SPLITS = ['test', 'val', 'train']
 DATA_DIR = os.path.abspath('data')
 ORIGINAL_DIR = os.path.join(DATA_DIR, 'original')
 SPE_ENCODER_PATH_SMILES = os.path.join(ORIGINAL_DIR, 'spe_codes_smiles.txt')
 SPE_ENCODER_PATH_SELFIES = os.path.join(ORIGINAL_DIR, 'spe_codes_selfies.txt')
+SELFIES_CACHE_PATH = os.path.join(DATA_DIR, 'selfies_cache.sqlite')
+SQLITE_BATCH_SIZE = 500  # number of molecules looked up in one sql query
+SPE_MEMO_SIZE = 1 << 18  # number of spe-tokenized molecules kept per process
 DATA_REDUCTION_FACTOR = args.reduce  # 0.0625, 0.125, 0.25, 0.5, 1.0 (no reduce)
+REDUCED_LINES_FILE = 'lines-train-r%s.npy' % DATA_REDUCTION_FACTOR  # path_lines
+N_WORKERS = args.workers  # 1 -> everything runs in the main process
+NESTED_FOLDS = args.nested  # True -> each fold is a subset of higher folds
+WRITE_BINARY = args.binary  # True -> also write memory-mapped token corpora
+WRITE_INDEX = args.index  # True -> also write line-offset indexes (seekable)
+CHUNK_SIZE = 1000  # number of reactions processed by one parallel job
+MAX_PENDING_JOBS = 4 * max(1, N_WORKERS)  # bounds memory used by job results
+WRITE_BUFFER_SIZE = 1 << 20  # bytes buffered before writing to the disk
+SEED = 1234
+W2V_CACHE_DIR = os.path.join(ORIGINAL_DIR, 'w2v_cache')
+W2V_PARAMS = {'vector_size': 256, 'min_count': 1, 'window': 5}
+W2V_THREADS = max(1, os.cpu_count() // max(1, N_WORKERS))  # gensim workers
+N_RANDOM_DRAWS = 2 * max(FOLDS)  # randomized smiles drawn once per molecule
+MoleculeEntry = namedtuple('MoleculeEntry', ['tokens', 'random_pool'])
 
 
 def main():
-    random.seed(1234)  # this is enough for replicable augmentation
     create_smiles_datasets()  # original data -> all tasks & data augmentations
     create_selfies_datasets()  # smiles data -> selfies data
     create_spe_datasets()  # smiles and selfies atom data -> spe data
     create_w2v_embeddings()  # smiles, selfies, atom, bpe -> added w2v vectors
+    if WRITE_BINARY:
+        create_binary_corpora()  # all text datasets -> binary token corpora
+    if WRITE_INDEX:
+        create_line_indexes()  # all text datasets -> line offset indexes
 
 
 def create_smiles_datasets():
     print('\nStarted generating smiles datasets')
-    for task in TASKS:
-        print('-- Task: %s' % task)
-        for fold in FOLDS:
-            print('---- Fold: %s' % fold)
-            generate_augmented_dataset(task, fold)
+    load_molecule_table()  # built once, then shared by all tasks and folds
+    fold_groups = [tuple(FOLDS)] if NESTED_FOLDS else [(f,) for f in FOLDS]
+    chunk_jobs = []
+    for task in SELECTED_TASKS:
+        for folds in fold_groups:
+            chunk_jobs.extend(generate_augmented_dataset(task, folds))
+    write_smiles_files(chunk_jobs)
 
 
 def create_selfies_datasets():
     print('\nStarted generating selfies datasets from smiles datasets')
-    for folder, files in filter_data_folders(additional_filters=['smiles',
-                                                                 'atom']):
-        for smiles_file in filter_data_files(files):
-            smiles_full_path = os.path.join(folder, smiles_file)
-            write_selfies_file_from_smiles_file(smiles_full_path)
+    with closing(open_selfies_cache()) as selfies_cache:
+        for folder, files in filter_data_folders(additional_filters=['smiles',
+                                                                     'atom']):
+            for smiles_file in filter_data_files(files):
+                smiles_full_path = os.path.join(folder, smiles_file)
+                write_selfies_file_from_smiles_file(smiles_full_path,
+                                                    selfies_cache)
+            copy_reduced_lines(folder, folder.replace('smiles', 'selfies'))
 
 
 def create_spe_datasets():
     print('\nStarted generating spe datasets from atom-tokenized datasets')
+    atom_paths = []
     for folder, files in filter_data_folders(additional_filters=['atom']):
         for atom_file in filter_data_files(files):
-            atom_full_path = os.path.join(folder, atom_file)
-            write_spe_file_from_atom_file(atom_full_path)
+            atom_paths.append(os.path.join(folder, atom_file))
+    write_spe_files_from_atom_files(atom_paths)
+    for folder, _ in filter_data_folders(additional_filters=['atom']):
+        copy_reduced_lines(folder, folder.replace('atom', 'spe'))
 
 
 def create_w2v_embeddings():
     print('\nStarted generating w2v embeddings for all input combinations')
-    for folder, _ in filter_data_folders():
-        mol_data = load_rxn_molecules_for_w2v(folder)
-        w2v_vectors = train_w2v_vectors(mol_data)
-        write_embedding_vectors(folder, w2v_vectors)
+    os.makedirs(W2V_CACHE_DIR, exist_ok=True)
+    folders = [folder for folder, _ in filter_data_folders()]
+    corpus_hashes = list(tqdm(run_jobs(hash_w2v_corpus, folders),
+                              total=len(folders),
+                              desc='-- Hashing w2v corpora'))
+
+    # Folders with the same reactions (e.g., product-pred and reactant-pred)
+    # share the same vectors, which are only trained once, across all runs
+    w2v_jobs = {h: f for f, h in zip(folders, corpus_hashes)}.items()
+    for _ in tqdm(run_jobs(train_and_cache_w2v_vectors, w2v_jobs),
+                  total=len(w2v_jobs),
+                  desc='-- Training w2v vectors'):
+        pass
+    for folder, corpus_hash in zip(folders, corpus_hashes):
+        write_embedding_vectors(folder, get_w2v_cache_path(corpus_hash))
+
+
+def create_binary_corpora():
+    print('\nStarted writing binary token corpora for all datasets')
+    # Only needed with --binary: onmt (torch, installed open-nmt) is optional
+    from onmt.inputters.binary_corpus import write_binary_corpus
+    text_paths = find_all_data_files()
+    for _ in tqdm(run_jobs(write_binary_corpus, text_paths),
+                  total=len(text_paths)):
+        pass
+
+
+def create_line_indexes():
+    print('\nStarted writing line offset indexes for all datasets')
+    from onmt.inputters.line_index import write_line_index  # only --index
+    text_paths = find_all_data_files()
+    for _ in tqdm(run_jobs(write_line_index, text_paths),
+                  total=len(text_paths)):
+        pass
+
+
+def find_all_data_files():
+    return [os.path.join(folder, text_file)
+            for folder, _, files in os.walk(DATA_DIR)
+            if 'original' not in folder and is_selected_task(folder)
+            for text_file in filter_data_files(files)]
 
 
 def filter_data_folders(additional_filters=[]):
    return [(folder, files) for folder, _, files in os.walk(DATA_DIR)
             if 'x1' in folder and 'x10' not in folder
             # and '-single' not in folder and '-noreag' not in folder
-            and all([f in folder for f in additional_filters])]
+            and all([f in folder for f in additional_filters])
+            and is_selected_task(folder)]
+
+
+def is_selected_task(folder):
+    # Compare path components, since task names are prefixes of one another
+    sub_dirs = os.path.relpath(folder, DATA_DIR).split(os.path.sep)
+    return sub_dirs[0] in SELECTED_TASKS
 
 
 def filter_data_files(files):
@@ -91,73 +183,322 @@ def filter_data_files(files):
             and '.txt' in f]
 
 
-def write_selfies_file_from_smiles_file(smiles_path):
+def copy_reduced_lines(in_folder, out_folder):
+    # Derived datasets are line-aligned with the ones they are converted from
+    lines_path = os.path.join(in_folder, REDUCED_LINES_FILE)
+    if DATA_REDUCTION_FACTOR < 1.0 and os.path.exists(lines_path):
+        shutil.copyfile(lines_path, os.path.join(out_folder,
+                                                 REDUCED_LINES_FILE))
+
+
+def write_selfies_file_from_smiles_file(smiles_path, selfies_cache):
     selfies_path = smiles_path.replace('smiles', 'selfies')
     os.makedirs(os.path.split(selfies_path)[0], exist_ok=True)
     with open(smiles_path, 'r') as f_smiles,\
-         open(selfies_path, 'w') as f_selfies:
-        progress_bar = tqdm(f_smiles.readlines())
-        for smiles in progress_bar:
-            progress_bar.set_description('Convert %s to selfies' % smiles_path)
-            f_selfies.write(create_selfies_from_smiles(smiles) + '\n')
-        
-
-def write_spe_file_from_atom_file(atom_path):
+         open(selfies_path, 'w', buffering=WRITE_BUFFER_SIZE) as f_selfies,\
+         tqdm(desc='Convert %s to selfies' % smiles_path) as progress_bar:
+        for smiles_chunk in read_line_chunks(f_smiles):
+            rxns = [[m.replace(' ', '') for m in smiles.strip().split(' . ')]
+                    for smiles in smiles_chunk]
+            selfies_dict = get_cached_selfies(
+                selfies_cache, {molecule for rxn in rxns for molecule in rxn})
+            f_selfies.writelines([' . '.join([selfies_dict[m] for m in rxn])
+                                  + '\n' for rxn in rxns])
+            progress_bar.update(len(smiles_chunk))
+
+
+def open_selfies_cache():
+    # Molecule-level smiles -> selfies store, shared by all tasks and all runs
+    selfies_cache = sqlite3.connect(SELFIES_CACHE_PATH)
+    selfies_cache.execute('CREATE TABLE IF NOT EXISTS selfies '
+                          '(smiles TEXT PRIMARY KEY, selfies TEXT NOT NULL)')
+    return selfies_cache
+
+
+def get_cached_selfies(selfies_cache, smiles_molecules):
+    """ Map smiles molecules to atom-tokenized selfies, only encoding the
+        molecules that were not already seen by any task or any previous run
+    """
+    smiles_molecules = list(smiles_molecules)
+    selfies_molecules = {}
+    for i in range(0, len(smiles_molecules), SQLITE_BATCH_SIZE):
+        batch = smiles_molecules[i:i + SQLITE_BATCH_SIZE]
+        query = 'SELECT smiles, selfies FROM selfies WHERE smiles IN (%s)'\
+                % ', '.join(['?'] * len(batch))
+        selfies_molecules.update(selfies_cache.execute(query, batch))
+
+    new_selfies = [(s, create_selfies_from_smiles_molecule(s))
+                   for s in smiles_molecules if s not in selfies_molecules]
+    if len(new_selfies) > 0:
+        selfies_cache.executemany(
+            'INSERT OR REPLACE INTO selfies VALUES (?, ?)', new_selfies)
+        selfies_cache.commit()
+        selfies_molecules.update(new_selfies)
+
+    return dict(zip(selfies_molecules.keys(),
+                    tokenize_many(selfies_molecules.values())))
+
+
+def write_spe_files_from_atom_files(atom_paths):
+    # Line chunks of all files are tokenized in parallel and come back in order
+    out_file, current_path = None, None
+    spe_jobs = generate_spe_jobs(atom_paths)
+    with tqdm() as progress_bar:
+        for atom_path, spe_lines in run_jobs(create_spe_chunk, spe_jobs):
+            if atom_path != current_path:
+                if out_file is not None: out_file.close()
+                spe_path = atom_path.replace('atom', 'spe')
+                os.makedirs(os.path.split(spe_path)[0], exist_ok=True)
+                out_file = open(spe_path, 'w', buffering=WRITE_BUFFER_SIZE)
+                current_path = atom_path
+                progress_bar.set_description('Convert %s to spe' % atom_path)
+            out_file.writelines(spe_lines)
+            progress_bar.update(len(spe_lines))
+    if out_file is not None: out_file.close()
+
+
+def generate_spe_jobs(atom_paths):
+    for atom_path in atom_paths:
+        spe_codes_path = get_spe_codes_path(atom_path)
+        with open(atom_path, 'r') as in_file:
+            for atom_chunk in read_line_chunks(in_file):
+                yield atom_path, spe_codes_path, atom_chunk
+
+
+def get_spe_codes_path(atom_path):
     # Find the correct spe-tokenizer (smiles or selfies)
     if 'smiles' in atom_path:
-        spe_path = SPE_ENCODER_PATH_SMILES
+        return SPE_ENCODER_PATH_SMILES
     elif 'selfies' in atom_path:
-        spe_path = SPE_ENCODER_PATH_SELFIES
+        return SPE_ENCODER_PATH_SELFIES
     else:
         raise ValueError('There is something wrong with the input data path')
-    with open(spe_path, 'r') as spe_file:
-        tokenizer = SPE_Tokenizer(codes=spe_file)
-
-    # Build a directory and a path for the new spe-tokenized dataset
-    spe_path = atom_path.replace('atom', 'spe')
-    os.makedirs(os.path.split(spe_path)[0], exist_ok=True)
-
-    # Build spe-tokenized dataset from the original dataset
-    with open(atom_path, 'r') as in_file,\
-         open(spe_path, 'w') as out_file:
-        progress_bar = tqdm(in_file.readlines())
-        for atom_tokenized_rxn in progress_bar:
-            progress_bar.set_description('Convert %s to spe' % atom_path)
-            rxn = atom_tokenized_rxn.replace(' ', '')
-            spe_tokenized_rnx = tokenizer.tokenize(rxn)
-            out_file.write(spe_tokenized_rnx + '\n')
-
-
-def generate_augmented_dataset(task, fold):
-    out_fulldir = os.path.join('data', task, 'smiles', 'atom', 'x%s' % fold)
-    os.makedirs(out_fulldir, exist_ok=True)
-    for split in SPLITS:
-        write_smiles_files(out_fulldir, task, fold, split)
-        if split == 'test' and task in USPTO_50K_TASKS:
-            write_smiles_files(out_fulldir, task, fold, '%s-50k' % split)
 
 
-def write_smiles_files(out_dir, task, fold, split):
-    if split != 'train':
-        fold = 1  # no augmentation for test and valid data
-    with open(os.path.join(ORIGINAL_DIR, 'src-%s.txt' % split), 'r') as src_in,\
-         open(os.path.join(ORIGINAL_DIR, 'tgt-%s.txt' % split), 'r') as tgt_in,\
-         open(os.path.join(out_dir, 'src-%s.txt' % split), 'w') as src_out,\
-         open(os.path.join(out_dir, 'tgt-%s.txt' % split), 'w') as tgt_out:
+def create_spe_chunk(spe_job):
+    # Spe codes never merge across molecules, so molecules are tokenized alone
+    atom_path, spe_codes_path, atom_chunk = spe_job
+    spe_lines = []
+    for atom_tokenized_rxn in atom_chunk:
+        molecules = atom_tokenized_rxn.strip().split(' . ')
+        spe_lines.append(' . '.join(
+            [spe_tokenize_molecule(spe_codes_path, m.replace(' ', ''))
+             for m in molecules]) + '\n')
+    return atom_path, spe_lines
+
+
+@lru_cache(maxsize=SPE_MEMO_SIZE)
+def spe_tokenize_molecule(spe_codes_path, molecule):
+    if len(molecule) == 0: return molecule
+    return load_spe_tokenizer(spe_codes_path).tokenize(molecule)
 
-        to_write = list(zip(src_in.readlines(), tgt_in.readlines()))
-        if 'train' in split and DATA_REDUCTION_FACTOR < 1.0:
-            to_write = [to_write[i] for i in get_reduced_data_indices()]
 
-        progress_bar = tqdm(to_write)
-        for src, tgt in progress_bar:
-            progress_bar.set_description('------ Split %s' % split)
-            species = parse_rxn(src, tgt)
-            new_src, new_tgt = create_new_sample(task, **species)
-            if len(new_src) == 0 or len(new_tgt) == 0: continue
-            new_src, new_tgt = augment_sample(new_src, new_tgt, fold)
-            src_out.write(new_src + '\n')
-            tgt_out.write(new_tgt + '\n')
+@lru_cache(maxsize=None)
+def load_spe_tokenizer(spe_codes_path):
+    with open(spe_codes_path, 'r') as spe_file:
+        return SPE_Tokenizer(codes=spe_file)
+
+
+def read_line_chunks(in_file, chunk_size=CHUNK_SIZE):
+    """ Yield lists of at most chunk_size lines, without reading whole files
+    """
+    while True:
+        line_chunk = list(islice(in_file, chunk_size))
+        if len(line_chunk) == 0: return
+        yield line_chunk
+
+
+def generate_augmented_dataset(task, folds):
+    # Folds generated together are drawn once, at the highest fold level
+    for fold in folds:
+        os.makedirs(get_smiles_dir(task, fold), exist_ok=True)
+    splits = []
+    for split in SPLITS:
+        splits.append(split)
+        if split == 'test' and task in USPTO_50K_TASKS:
+            splits.append('%s-50k' % split)
+    return [(task, folds, split, start) for split in splits
+            for start in range(0, len(get_rxn_indices(split)), CHUNK_SIZE)]
+
+
+def get_smiles_dir(task, fold):
+    return os.path.join(DATA_DIR, task, 'smiles', 'atom', 'x%s' % fold)
+
+
+def write_smiles_files(chunk_jobs):
+    # Chunks come back in order, so that files are identical to a serial run
+    out_files, current_files = {}, None
+    reduced_lines = ReducedLines()
+    progress_bar = tqdm(zip(chunk_jobs, run_jobs(create_smiles_chunk,
+                                                 chunk_jobs)),
+                        total=len(chunk_jobs))
+    for (task, folds, split, _), fold_lines in progress_bar:
+        fold_descr = '/'.join(['x%s' % fold for fold in folds])
+        progress_bar.set_description('-- %s %s %s' % (task, fold_descr, split))
+        if (task, folds, split) != current_files:
+            close_smiles_files(out_files)
+            out_files = open_smiles_files(task, folds, split)
+            current_files = (task, folds, split)
+        for fold, (src_lines, tgt_lines, line_rxns) in fold_lines.items():
+            src_out, tgt_out = out_files[fold]
+            src_out.writelines(src_lines)
+            tgt_out.writelines(tgt_lines)
+            if split == 'train': reduced_lines.add(task, fold, line_rxns)
+    close_smiles_files(out_files)
+    reduced_lines.write()
+
+
+class ReducedLines(object):
+    """ Line numbers of the reduced training data in the full training files,
+        written as a path_lines file instead of a reduced copy of the data
+        (augmented samples of the kept reactions, in the reduced data order)
+    """
+    def __init__(self):
+        self.reduced = DATA_REDUCTION_FACTOR < 1.0
+        if self.reduced:
+            self.rxn_ranks = {rxn_index: rank for rank, rxn_index
+                              in enumerate(get_reduced_data_indices())}
+        self.n_lines = {}
+        self.lines = {}
+
+    def add(self, task, fold, line_rxns):
+        if not self.reduced: return
+        first_line = self.n_lines.get((task, fold), 0)
+        self.lines.setdefault((task, fold), []).extend(
+            [(self.rxn_ranks[rxn_index], first_line + i)
+             for i, rxn_index in enumerate(line_rxns)
+             if rxn_index in self.rxn_ranks])
+        self.n_lines[(task, fold)] = first_line + len(line_rxns)
+
+    def write(self):
+        for (task, fold), lines in self.lines.items():
+            line_numbers = np.array([line for _, line in sorted(lines)],
+                                    dtype=np.int64)
+            np.save(os.path.join(get_smiles_dir(task, fold),
+                                 REDUCED_LINES_FILE), line_numbers)
+
+
+def open_smiles_files(task, folds, split):
+    out_files = {}
+    for fold in folds:
+        out_dir = get_smiles_dir(task, fold)
+        out_files[fold] = tuple(
+            open(os.path.join(out_dir, '%s-%s.txt' % (side, split)), 'w',
+                 buffering=WRITE_BUFFER_SIZE) for side in ['src', 'tgt'])
+    return out_files
+
+
+def close_smiles_files(out_files):
+    for src_out, tgt_out in out_files.values():
+        src_out.close()
+        tgt_out.close()
+
+
+def create_smiles_chunk(chunk_job):
+    task, folds, split, start = chunk_job
+    if split != 'train':
+        folds_taken = {fold: 1 for fold in folds}  # no augmentation for test
+    else:                                          # and valid data
+        folds_taken = {fold: fold for fold in folds}
+    original_rxns = load_original_rxns(split)
+    fold_lines = {fold: ([], [], []) for fold in folds}
+    for rxn_index in get_rxn_indices(split)[start:start + CHUNK_SIZE]:
+        rng = get_rxn_rng(task, split, rxn_index)
+        species = original_rxns[rxn_index]
+        new_src, new_tgt = create_new_sample(task, rng=rng, **species)
+        if len(new_src) == 0 or len(new_tgt) == 0: continue
+        max_fold = max(folds_taken.values())
+        src_augm, tgt_augm = augment_sample(new_src, new_tgt, max_fold, rng)
+        if len(folds) > 1:
+            src_augm[0] = new_src  # so that x1 is the non-augmented sample
+        for fold, (src_lines, tgt_lines, line_rxns) in fold_lines.items():
+            n_taken = folds_taken[fold]  # lower folds are prefixes of max_fold
+            src_lines.extend([s + '\n' for s in src_augm[:n_taken]])
+            tgt_lines.extend([t + '\n' for t in tgt_augm[:n_taken]])
+            line_rxns.extend([rxn_index] * len(src_augm[:n_taken]))
+    return fold_lines
+
+
+def run_jobs(job_fn, jobs):
+    """ Yield the results of job_fn for all jobs, in the order of the jobs,
+        using a pool of N_WORKERS processes if more than one is requested
+        (at most MAX_PENDING_JOBS results are held in memory at a time)
+    """
+    if N_WORKERS <= 1:
+        yield from map(job_fn, jobs)
+    else:
+        with Pool(N_WORKERS) as pool:
+            pending = deque()
+            for job in jobs:
+                pending.append(pool.apply_async(job_fn, (job,)))
+                if len(pending) >= MAX_PENDING_JOBS:
+                    yield pending.popleft().get()
+            while len(pending) > 0:
+                yield pending.popleft().get()
+
+
+def get_rxn_rng(task, split, rxn_index):
+    """ Random stream that only depends on the reaction it is used for, so that
+        augmentation is reproducible whatever the number of workers
+    """
+    return random.Random('%s-%s-%s-%s' % (SEED, task, split, rxn_index))
+
+
+@lru_cache(maxsize=None)
+def load_original_rxns(split):
+    # Original reactions are read and parsed only once for all tasks and folds
+    with open(os.path.join(ORIGINAL_DIR, 'src-%s.txt' % split), 'r') as src_in,\
+         open(os.path.join(ORIGINAL_DIR, 'tgt-%s.txt' % split), 'r') as tgt_in:
+        return [parse_rxn(src, tgt) for src, tgt in zip(src_in, tgt_in)]
+
+
+@lru_cache(maxsize=None)
+def get_rxn_indices(split):
+    # All reactions, even with --reduce: the reduced training data is only
+    # a list of lines of the full data (see ReducedLines), not its own files
+    return list(range(len(load_original_rxns(split))))
+
+
+@lru_cache(maxsize=None)
+def load_molecule_table():
+    """ Map each unique training molecule to its tokens and to a pool of
+        randomized smiles drawn once, from which all tasks and augmentation
+        folds sample their equivalent smiles (rdkit molecules are not kept,
+        so that the table stays small in the workers it is copied to)
+    """
+    train_rxns = load_original_rxns('train')
+    molecules = sorted({molecule.replace(' ', '')
+                        for rxn_index in get_rxn_indices('train')
+                        for species in train_rxns[rxn_index].values()
+                        for molecule in species})
+    molecule_chunks = [molecules[i:i + CHUNK_SIZE]
+                       for i in range(0, len(molecules), CHUNK_SIZE)]
+    molecule_table = {}
+    for molecule_chunk, entries in tqdm(zip(molecule_chunks,
+                                            run_jobs(create_molecule_entries,
+                                                     molecule_chunks)),
+                                        total=len(molecule_chunks),
+                                        desc='-- Building molecule table'):
+        molecule_table.update(zip(molecule_chunk, entries))
+    return molecule_table
+
+
+def create_molecule_entries(smiles_chunk):
+    return [create_molecule_entry(smiles) for smiles in smiles_chunk]
+
+
+def create_molecule_entry(smiles):
+    mol = Chem.MolFromSmiles(smiles)
+    random_pool = []
+    if mol is not None:
+        smiles_rng = random.Random('%s-%s' % (SEED, smiles))
+        rdkit_seed = smiles_rng.randrange(1, 2 ** 31)  # rdkit ignores 0 seeds
+        for new_smiles in Chem.MolToRandomSmilesVect(mol, N_RANDOM_DRAWS,
+                                                     randomSeed=rdkit_seed):
+            if new_smiles != smiles and new_smiles not in random_pool:
+                random_pool.append(new_smiles)
+    return MoleculeEntry(tokens=atomwise_tokenizer(smiles),
+                         random_pool=tokenize_many(random_pool))
 
 
 def parse_rxn(src, tgt):
@@ -171,7 +512,7 @@ def parse_rxn(src, tgt):
             'products': [p for p in products if p != '']}
 
 
-def create_new_sample(task, reactants, reagents, products):
+def create_new_sample(task, reactants, reagents, products, rng=random):
     if task == 'product-pred':
         new_src = ' . '.join(reactants + reagents)
         new_tgt = ' . '.join(products)
@@ -185,7 +526,7 @@ def create_new_sample(task, reactants, reagents, products):
         new_src = ' . '.join(products)
         new_tgt = ' . '.join(reactants)
     elif task == 'reactant-pred-single':
-        single_react = random.sample(reactants, 1)  # list
+        single_react = rng.sample(reactants, 1)  # list
         other_reacts = [r for r in reactants if r != single_react[0]]
         new_src = ' . '.join(other_reacts + reagents + products)
         new_tgt = ' . '.join(single_react)
@@ -197,48 +538,30 @@ def create_new_sample(task, reactants, reagents, products):
     return new_src, new_tgt
 
 
-def augment_sample(src, tgt, fold):
-    if fold == 1: return src, tgt  # i.e., no augmentation
+def augment_sample(src, tgt, fold, rng=random):
+    if fold == 1: return [src], [tgt]  # i.e., no augmentation
     src_smiles_list = src.split(' . ')
-    src_augm = [generate_n_equivalent_smiles(s, fold) for s in src_smiles_list]
+    src_augm = [generate_n_equivalent_smiles(s, fold, rng)
+                for s in src_smiles_list]
     src_augm = [list(s) for s in list(zip(*src_augm))]  # re-group molecules
-    [random.shuffle(s) for s in src_augm]  # shuffle molecule order
+    [rng.shuffle(s) for s in src_augm]  # shuffle molecule order
     src_augm = [' . '.join(s) for s in src_augm]  # put back in token string
     tgt_augm = [tgt] * fold  # [' . '.join(sorted(tgt.split(' . ')))] * fold
-    return '\n'.join(src_augm), '\n'.join(tgt_augm)
-
+    return src_augm, tgt_augm
 
-def generate_n_equivalent_smiles(smiles_tokens, n):
-    smiles = smiles_tokens.replace(' ', '')
-    mol = Chem.MolFromSmiles(smiles)
-    new_smiles_list = [smiles]
-    trials = 0
 
-    while len(new_smiles_list) < n and trials < 2 * n:
-        new_smiles = Chem.MolToSmiles(mol, doRandom=True, canonical=False)
-        trials += 1
-        if new_smiles not in new_smiles_list:
-            new_smiles_list.append(new_smiles)
+def generate_n_equivalent_smiles(smiles_tokens, n, rng=random):
+    entry = load_molecule_table()[smiles_tokens.replace(' ', '')]
+    n_sampled = min(n - 1, len(entry.random_pool))
+    new_smiles_list = [entry.tokens] + rng.sample(entry.random_pool, n_sampled)
 
     if len(new_smiles_list) < n:  # complete list for very short molecules
         factor = n // len(new_smiles_list) + 1
         new_smiles_list = (new_smiles_list * factor)[:n]
 
-    new_smiles_list = [atomwise_tokenizer(s) for s in new_smiles_list]
     return new_smiles_list
 
 
-def atomwise_tokenizer(smiles):
-    # From https://github.com/pschwllr/MolecularTransformer
-    # Should also work with selfies (thanks to the [])
-    pattern = '(\[[^\]]+]|Br?|Cl?|N|O|S|P|F|I|b|c|n|o|s|p|\(|\)'+\
-              '|\.|=|#|-|\+|\\\\|\/|:|~|@|\?|>|\*|\$|\%[0-9]{2}|[0-9])'
-    regex = re.compile(pattern)
-    tokens = [token for token in regex.findall(smiles)]
-    assert smiles == ''.join(tokens)
-    return ' '.join(tokens)
-    
-
 def canonicalize_smiles(smiles):
     try:
         return Chem.MolToSmiles(Chem.MolFromSmiles(smiles))
@@ -246,25 +569,11 @@ def canonicalize_smiles(smiles):
         return smiles
 
 
-def create_selfies_from_smiles(smiles):
-    smiles = smiles.replace(' ', '')
+def create_selfies_from_smiles_molecule(smiles_mol):
     try:
-        selfies = sf.encoder(smiles)
+        return sf.encoder(smiles_mol)
     except sf.EncoderError:
-        selfies = create_selfies_from_smiles_molecule_by_molecule(smiles)
-    return atomwise_tokenizer(selfies)
-
-
-def create_selfies_from_smiles_molecule_by_molecule(smiles):
-    smiles_mols = smiles.split('.')
-    selfies_mols = []
-    for smiles_mol in smiles_mols:
-        try:
-            selfies_mol = sf.encoder(smiles_mol)
-        except sf.EncoderError:
-            selfies_mol = create_seflies_from_canonic_smiles(smiles_mol)
-        selfies_mols.append(selfies_mol)
-    return '.'.join(selfies_mols)
+        return create_seflies_from_canonic_smiles(smiles_mol)
 
 
 def create_seflies_from_canonic_smiles(smiles_molecule):
@@ -292,20 +601,62 @@ def create_seflies_from_canonic_smiles(smiles_molecule):
         # O=c1[nH]c2c3occc3c(F)c(F)c2n1-c1ccc([IH]S(=O)(=O)C2CC2COCc2ccccc2)cc1F
 
 
-def load_rxn_molecules_for_w2v(data_dir_in):
-    # Consider reactions as sets of dot-separated molecules
-    # The goal is to share src and tgt embeddings for any task
-    with open(os.path.join(data_dir_in, 'src-train.txt'), 'r') as f_src,\
-         open(os.path.join(data_dir_in, 'tgt-train.txt'), 'r') as f_tgt:
-        sentences = []
-        for src, tgt in zip(f_src.readlines(), f_tgt.readlines()):
-            molecules = ' . '.join([src.strip(), tgt.strip()])
-            sentences.append(molecules.split())
-    return sentences
+class RxnSentences(object):
+    """ Restartable stream of the training reactions of a data folder, read
+        from the disk each time w2v goes through the corpus
+    """
+    def __init__(self, data_dir_in):
+        self.data_dir_in = data_dir_in
+
+    def __iter__(self):
+        # Consider reactions as sets of dot-separated molecules
+        # The goal is to share src and tgt embeddings for any task
+        data_dir_in = self.data_dir_in
+        line_numbers = read_reduced_lines(data_dir_in)
+        with open(os.path.join(data_dir_in, 'src-train.txt'), 'r') as f_src,\
+             open(os.path.join(data_dir_in, 'tgt-train.txt'), 'r') as f_tgt:
+            for i, (src, tgt) in enumerate(zip(f_src, f_tgt)):
+                if line_numbers is not None and i not in line_numbers: continue
+                molecules = ' . '.join([src.strip(), tgt.strip()])
+                yield ' . '.join(sorted(molecules.split(' . '))).split()
+
+
+def read_reduced_lines(data_dir_in):
+    # Set of the training lines used by the reduced data (None: all of them)
+    lines_path = os.path.join(data_dir_in, REDUCED_LINES_FILE)
+    if DATA_REDUCTION_FACTOR >= 1.0 or not os.path.exists(lines_path):
+        return None
+    return set(np.load(lines_path).tolist())
+
+
+def hash_w2v_corpus(data_dir_in):
+    """ Hash of the multiset of reactions of a folder (and of w2v parameters),
+        which does not depend on the order of reactions and of molecules
+    """
+    corpus_hash = int(hashlib.sha256(repr(W2V_PARAMS).encode()).hexdigest(), 16)
+    for sentence in RxnSentences(data_dir_in):
+        digest = hashlib.sha256(' '.join(sentence).encode()).hexdigest()
+        corpus_hash = (corpus_hash + int(digest, 16)) % 2 ** 256
+    return '%064x' % corpus_hash
+
+
+def get_w2v_cache_path(corpus_hash):
+    return os.path.join(W2V_CACHE_DIR, '%s.wordvectors' % corpus_hash)
+
+
+def train_and_cache_w2v_vectors(w2v_job):
+    corpus_hash, data_dir_in = w2v_job
+    cache_path = get_w2v_cache_path(corpus_hash)
+    if not os.path.exists(cache_path):
+        w2v_vectors = train_w2v_vectors(RxnSentences(data_dir_in))
+        tmp_path = '%s.%s.tmp' % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:  # file object: one file, no .npy
+            w2v_vectors.save(f)
+        os.replace(tmp_path, cache_path)  # partial vectors are never cached
 
 
 def train_w2v_vectors(sentences):
-    model = Word2Vec(vector_size=256, min_count=1, window=5)
+    model = Word2Vec(**W2V_PARAMS, workers=W2V_THREADS)
     model.build_vocab(corpus_iterable=sentences)  # should check clash with omt
     model.train(corpus_iterable=sentences,
                 epochs=model.epochs,
@@ -314,9 +665,14 @@ def train_w2v_vectors(sentences):
     return model.wv
 
 
-def write_embedding_vectors(in_dir, embedding_vectors):
+def write_embedding_vectors(in_dir, cache_path):
     print('-- Writing embeddings vectors for %s' % in_dir)
+    embedding_vectors = KeyedVectors.load(cache_path)
     embedding_vectors.save(os.path.join(in_dir, 'w2v.wordvectors'))
+    np.save(os.path.join(in_dir, 'w2v-embeddings.npy'),
+            embedding_vectors.vectors.astype(np.float32))  # binary vectors
+    with open(os.path.join(in_dir, 'w2v-embeddings.tokens'), 'w') as f:
+        f.writelines([token + '\n' for token in embedding_vectors.index_to_key])
     with open(os.path.join(in_dir, 'w2v-embeddings.txt'), 'w') as f:
         for token in embedding_vectors.index_to_key:
             vector = embedding_vectors[token].tolist()
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import subprocess
+from collections import namedtuple
+
+
+# Resources of one job, as in the slurm scripts (data/original/base_slurm.sh)
+ScheduledJob = namedtuple('ScheduledJob', ['name', 'command', 'cpus', 'memory',
+                                           'gpus', 'deps', 'log_path'])
+ScheduledJob.__new__.__defaults__ = (1, 0, 0, (), None)
+POLL_INTERVAL = 1.0  # seconds between two checks of the running jobs
+
+
+def run_scheduled_jobs(jobs, n_cpus, memory, n_gpus, journal_path,
+                       n_retries=1):
+    """ Run shell commands concurrently, within cpu, memory and gpu budgets
+    Args:
+        - jobs: ScheduledJob list, started in this order when resources allow,
+            each job waiting for the jobs named in its deps to succeed; a dep
+            that is not in jobs must be recorded as done in the journal (e.g.,
+            by a previous run), otherwise the job is cancelled
+        - n_cpus, memory (GB), n_gpus: resources shared by all running jobs
+        - journal_path: json-lines file recording every job start and end;
+            jobs recorded as done with the same command are not run again,
+            so that an interrupted run resumes where it stopped
+        - n_retries: number of times a failed job is restarted
+    Returns:
+        - names of the jobs that failed (including those whose deps failed)
+    """
+    done = read_done_jobs(journal_path)
+    pending = [job for job in jobs if done.get(job.name) != job.command]
+    known = {job.name for job in jobs} | set(done)
+    skipped = {job.name for job in jobs} - {job.name for job in pending}
+    if len(skipped) > 0:
+        print('-- Skipping %s job(s) already done' % len(skipped))
+    capacity = {'cpus': n_cpus, 'memory': memory, 'gpus': n_gpus}
+    free = dict(capacity)
+    free_gpu_ids = list(range(n_gpus))
+    running, failed, attempts = {}, set(), {}
+    os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            # Start every ready job that fits in the remaining resources
+            for job in list(pending):
+                unknown = [dep for dep in job.deps if dep not in known]
+                if any(dep in failed for dep in job.deps) or len(unknown) > 0:
+                    pending.remove(job)
+                    failed.add(job.name)
+                    write_journal_line(journal_path, job, 'cancelled')
+                    reason = 'unknown deps: %s' % ', '.join(unknown)\
+                             if len(unknown) > 0 else 'failed deps'
+                    print('-- Cancelled %s (%s)' % (job.name, reason))
+                    continue
+                if any(dep in running or dep in [j.name for j in pending]
+                       for dep in job.deps):
+                    continue
+                needs = get_job_needs(job, capacity)
+                if all(needs[r] <= free[r] for r in free):
+                    pending.remove(job)
+                    gpu_ids = [free_gpu_ids.pop(0)
+                               for _ in range(needs['gpus'])]
+                    for r in free: free[r] -= needs[r]
+                    attempts[job.name] = attempts.get(job.name, 0) + 1
+                    running[job.name] = (job, gpu_ids, time.time(),
+                                         start_job(job, needs, gpu_ids))
+                    write_journal_line(journal_path, job, 'started')
+
+            # Release the resources of finished jobs, retrying failed ones
+            time.sleep(POLL_INTERVAL)
+            for name, (job, gpu_ids, start, process) in list(running.items()):
+                if process.poll() is None: continue
+                del running[name]
+                needs = get_job_needs(job, capacity)
+                for r in free: free[r] += needs[r]
+                free_gpu_ids.extend(gpu_ids)
+                wall_time = time.time() - start
+                if process.returncode == 0:
+                    status = 'done'
+                elif attempts[name] <= n_retries:
+                    status = 'retried'
+                    pending.insert(0, job)
+                else:
+                    status = 'failed'
+                    failed.add(name)
+                write_journal_line(journal_path, job, status, wall_time)
+                print('-- %s %s (%.0fs, attempt %s)'
+                      % (status.capitalize(), name, wall_time, attempts[name]))
+    except KeyboardInterrupt:  # journal is kept, next run resumes from it
+        for _, _, _, process in running.values():
+            process.terminate()
+        raise
+    return sorted(failed)
+
+
+def get_job_needs(job, capacity):
+    # A job bigger than the machine still runs, alone
+    return {'cpus': min(job.cpus, capacity['cpus']),
+            'memory': min(job.memory, capacity['memory']),
+            'gpus': min(job.gpus, capacity['gpus'])}
+
+
+def start_job(job, needs, gpu_ids):
+    env = dict(os.environ)
+    n_threads = str(max(1, needs['cpus']))  # pin torch intra-op threads
+    env.update({'OMP_NUM_THREADS': n_threads, 'MKL_NUM_THREADS': n_threads})
+    if needs['gpus'] > 0 or job.gpus == 0:  # gpu 0 of a job is its own gpu
+        env['CUDA_VISIBLE_DEVICES'] = ','.join(map(str, gpu_ids))
+    out_file = None
+    if job.log_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(job.log_path)),
+                    exist_ok=True)
+        out_file = open(job.log_path, 'a')
+    process = subprocess.Popen(job.command, shell=True, env=env,
+                               stdout=out_file, stderr=subprocess.STDOUT
+                               if out_file is not None else None)
+    if out_file is not None:
+        out_file.close()  # the child process keeps its own handle
+    return process
+
+
+def read_done_jobs(journal_path):
+    done = {}
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['status'] == 'done':
+                    done[record['name']] = record['command']
+                elif record['name'] in done and record['status'] == 'started':
+                    del done[record['name']]  # started again since then
+    return done
+
+
+def write_journal_line(journal_path, job, status, wall_time=None):
+    record = {'name': job.name, 'command': job.command, 'status': status,
+              'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'wall_time': wall_time}
+    with open(journal_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
@@ -9,11 +9,12 @@ from onmt.utils.parse import ArgumentParser
 from collections import defaultdict
 
 
-def translate(opt):
+def translate(opt, loaded_model=None):
     ArgumentParser.validate_translate_opts(opt)
     logger = init_logger(opt.log_file)
 
-    translator = build_translator(opt, logger=logger, report_score=True)
+    translator = build_translator(opt, logger=logger, report_score=True,
+                                  loaded_model=loaded_model)
     src_shards = split_corpus(opt.src, opt.shard_size)
     tgt_shards = split_corpus(opt.tgt, opt.shard_size)
     features_shards = []
@@ -37,6 +38,7 @@ def translate(opt):
             attn_debug=opt.attn_debug,
             align_debug=opt.align_debug
             )
+    return translator
 
 
 def _get_parser():
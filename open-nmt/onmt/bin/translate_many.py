@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Translate several configurations in one process, loading each model once.
+
+Configurations that share the same checkpoint(s) and loading options (e.g.,
+``test`` and ``test-50k`` of one model) reuse the model, fields and model
+options loaded for the first of them, and only differ in their data, outputs
+and decoding options.
+"""
+import argparse
+from collections import OrderedDict
+
+from onmt.bin.translate import translate, _get_parser
+from onmt.translate.translator import load_translation_model
+
+
+def group_opts_by_model(config_paths):
+    parser = _get_parser()
+    opts_by_model = OrderedDict()
+    for config_path in config_paths:
+        opt = parser.parse_args(['-config', config_path])
+        model_key = (tuple(opt.models), opt.gpu, opt.fp32, opt.int8)
+        opts_by_model.setdefault(model_key, []).append(opt)
+    return opts_by_model
+
+
+def translate_many(config_paths):
+    for opts in group_opts_by_model(config_paths).values():
+        loaded_model = load_translation_model(opts[0])
+        for opt in opts:
+            translator = translate(opt, loaded_model=loaded_model)
+            translator.out_file.close()
+
+
+def _get_many_parser():
+    parser = argparse.ArgumentParser(description='translate_many.py')
+    parser.add_argument('-configs', '--configs', nargs='+', required=True,
+                        help="Translation config files, whose models are "
+                             "loaded once for all configs using them.")
+    return parser
+
+
+def main():
+    parser = _get_many_parser()
+
+    opt = parser.parse_args()
+    translate_many(opt.configs)
+
+
+if __name__ == "__main__":
+    main()
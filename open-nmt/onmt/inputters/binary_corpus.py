@@ -0,0 +1,90 @@
+"""Memory-mapped binary token corpus.
+
+A tokenized text file ``<name>.txt`` can be stored next to itself as:
+
+* ``<name>.ids.npy``: flat array with the token ids of all its lines;
+* ``<name>.offsets.npy``: ``n_lines + 1`` offsets of the lines in the ids;
+* ``<name>.tokens``: one token per line, the i-th token having id i.
+
+Both arrays are opened with ``np.load(mmap_mode='r')``, so that lines are
+read without copying, decoding or splitting any text.
+"""
+import os
+from array import array
+
+import numpy as np
+
+
+BINARY_CORPUS_SUFFIXES = ('.ids.npy', '.offsets.npy', '.tokens')
+
+
+def binary_corpus_paths(path):
+    """Return the (ids, offsets, tokens) paths of text file ``path``."""
+    prefix = os.path.splitext(path)[0]
+    return tuple(prefix + suffix for suffix in BINARY_CORPUS_SUFFIXES)
+
+
+def has_binary_corpus(path):
+    """Whether an up-to-date binary corpus exists for text file ``path``."""
+    if path is None:
+        return False
+    binary_paths = binary_corpus_paths(path)
+    if not all(os.path.exists(p) for p in binary_paths):
+        return False
+    if os.path.exists(path):  # text file written after its binary corpus
+        binary_mtime = min(os.path.getmtime(p) for p in binary_paths)
+        return os.path.getmtime(path) <= binary_mtime
+    return True
+
+
+def write_binary_corpus(path):
+    """Store the tokenized text file ``path`` as a binary corpus.
+
+    Token ids are stored as uint16 when the vocabulary allows it, which
+    is the case for atom-level and spe-level chemical corpora.
+    """
+    vocab = {}
+    ids, offsets = array('i'), array('q', [0])
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            ids.extend([vocab.setdefault(token, len(vocab))
+                        for token in line.split()])
+            offsets.append(len(ids))
+    dtype = np.uint16 if len(vocab) <= 2 ** 16 else np.int32
+    ids_path, offsets_path, tokens_path = binary_corpus_paths(path)
+    np.save(ids_path, np.frombuffer(ids, dtype=np.int32).astype(dtype))
+    np.save(offsets_path, np.frombuffer(offsets, dtype=np.int64))
+    with open(tokens_path, 'w', encoding='utf-8') as f:  # written last
+        f.writelines(token + '\n' for token in vocab)
+
+
+class BinaryCorpus(object):
+    """Read-only, memory-mapped view of the binary corpus of ``path``."""
+
+    def __init__(self, path):
+        ids_path, offsets_path, tokens_path = binary_corpus_paths(path)
+        self.ids = np.load(ids_path, mmap_mode='r')
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+        with open(tokens_path, 'r', encoding='utf-8') as f:
+            self.tokens = np.array(f.read().split('\n')[:-1], dtype=object)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line_ids(self, i):
+        """Token ids of line ``i``, as a view of the memory-mapped ids."""
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        """Tokens of line ``i``."""
+        return self.tokens[self.line_ids(i)].tolist()
+
+    def iter_tokens(self, offset=0, stride=1):
+        """Iterate over the tokens of every ``stride`` line from ``offset``."""
+        for i in range(offset, len(self), stride):
+            yield self[i]
+
+    def iter_text(self, offset=0, stride=1):
+        """Same as ``iter_tokens``, but yield space-joined lines."""
+        for tokens in self.iter_tokens(offset, stride):
+            yield ' '.join(tokens)
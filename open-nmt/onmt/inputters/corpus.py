@@ -4,13 +4,18 @@ from onmt.utils.logging import logger
 from onmt.constants import CorpusName
 from onmt.transforms import TransformPipe
 from onmt.inputters.dataset_base import _dynamic_dict
+from onmt.inputters.binary_corpus import BinaryCorpus, has_binary_corpus
+from onmt.inputters.line_index import LineIndex, has_line_index, \
+    shuffled_line_numbers
 from torchtext.data import Dataset as TorchtextDataset, \
     Example as TorchtextExample
 
 from collections import Counter, defaultdict
 from contextlib import contextmanager
+from itertools import repeat
 
 import multiprocessing as mp
+import numpy as np
 
 
 @contextmanager
@@ -115,15 +120,97 @@ class DatasetAdapter(object):
 
 
 class ParallelCorpus(object):
-    """A parallel corpus file pair that can be loaded to iterate."""
+    """A parallel corpus file pair that can be loaded to iterate.
 
-    def __init__(self, name, src, tgt, align=None, src_feats=None):
+    If `line_numbers` is given, the corpus is a view that only iterates on
+    these lines, in their order, read by seeking (see `LineIndex`).
+    """
+
+    def __init__(self, name, src, tgt, align=None, src_feats=None,
+                 line_numbers=None):
         """Initialize src & tgt side file path."""
         self.id = name
         self.src = src
         self.tgt = tgt
         self.align = align
         self.src_feats = src_feats
+        self.line_numbers = line_numbers
+        # (src_start, src_end, tgt_start, tgt_end) set by `split_by_bytes`
+        self.byte_range = None
+        self.first_line = 0
+
+    def is_binary(self):
+        """Whether src and tgt can be read from binary corpora."""
+        return (self.align is None and not self.src_feats
+                and has_binary_corpus(self.src)
+                and has_binary_corpus(self.tgt))
+
+    def is_indexed(self):
+        """Whether all files of the corpus have an up-to-date line index."""
+        return all(has_line_index(path) for path in self._paths())
+
+    def _paths(self):
+        paths = [self.src, self.tgt]
+        if self.align is not None:
+            paths.append(self.align)
+        if self.src_feats:
+            paths.extend(self.src_feats.values())
+        return paths
+
+    def view(self, line_numbers):
+        """Corpus iterating only on `line_numbers` (e.g. a data subset)."""
+        return ParallelCorpus(self.id, self.src, self.tgt, self.align,
+                              self.src_feats, line_numbers=line_numbers)
+
+    def shuffled(self, seed, block_size=1, window_size=1):
+        """
+        Corpus iterating on the same lines, in a random order (see
+        `shuffled_line_numbers`).
+        """
+        line_numbers = self.line_numbers
+        if line_numbers is None:
+            line_numbers = np.arange(self.n_lines())
+        order = shuffled_line_numbers(len(line_numbers), seed,
+                                      block_size, window_size)
+        return self.view(np.asarray(line_numbers)[order])
+
+    def line_number(self, position):
+        """Line of the corpus files read as the `position`-th example."""
+        if self.line_numbers is None:
+            return self.first_line + position
+        return int(self.line_numbers[position])
+
+    def n_lines(self):
+        """Number of src/tgt line pairs of the corpus files."""
+        if self.is_binary():
+            return min(len(BinaryCorpus(path))
+                       for path in [self.src, self.tgt])
+        return min(len(LineIndex(path)) for path in self._paths())
+
+    def can_split_by_bytes(self):
+        """Whether `split_by_bytes` applies to this corpus."""
+        return (self.align is None and not self.src_feats
+                and self.byte_range is None and self.line_numbers is None
+                and not self.is_binary())
+
+    def split_by_bytes(self, n_chunks):
+        """
+        Split the corpus into at most `n_chunks` corpora, each reading only
+        its own newline-aligned byte range of src, and the byte range of
+        tgt holding the same lines. Boundaries are found by scanning raw
+        bytes, without decoding any line.
+        """
+        src_offsets = _newline_aligned_offsets(self.src, n_chunks)
+        line_starts = _count_lines_before(self.src, src_offsets)
+        tgt_offsets = _line_start_offsets(self.tgt, line_starts)
+        chunks = []
+        for k in range(len(src_offsets) - 1):
+            chunk = ParallelCorpus(self.id, self.src, self.tgt)
+            chunk.byte_range = (src_offsets[k], src_offsets[k + 1],
+                                tgt_offsets[k], tgt_offsets[k + 1])
+            chunk.first_line = line_starts[k]
+            chunks.append(chunk)
+        return chunks
 
     def load(self, offset=0, stride=1):
         """
@@ -131,49 +218,168 @@ class ParallelCorpus(object):
         `offset` and `stride` allow to iterate only on every
         `stride` example, starting from `offset`.
         """
+        if self.is_binary():
+            yield from self._load_binary(offset, stride)
+            return
+        if self.byte_range is None and (self.line_numbers is not None
+                                        or self.is_indexed()):
+            yield from self._load_indexed(offset, stride)
+            return
         if self.src_feats:
-            features_names = []
             features_files = []
-            for feat_name, feat_path in self.src_feats.items():
-                features_names.append(feat_name)
+            for feat_path in self.src_feats.values():
                 features_files.append(open(feat_path, mode='rb'))
         else:
             features_files = []
         with exfile_open(self.src, mode='rb') as fs,\
                 exfile_open(self.tgt, mode='rb') as ft,\
                 exfile_open(self.align, mode='rb') as fa:
+            if self.byte_range is not None:
+                src_start, src_end, tgt_start, tgt_end = self.byte_range
+                fs = _read_byte_range(fs, src_start, src_end)
+                ft = _read_byte_range(ft, tgt_start, tgt_end)
             for i, (sline, tline, align, *features) in \
                     enumerate(zip(fs, ft, fa, *features_files)):
                 if (i % stride) == offset:
-                    sline = sline.decode('utf-8')
-                    tline = tline.decode('utf-8')
-                    # 'src_original' and 'tgt_original' store the
-                    # original line before tokenization. These
-                    # fields are used later on in the feature
-                    # transforms.
-                    example = {
-                        'src': sline,
-                        'tgt': tline,
-                        'src_original': sline,
-                        'tgt_original': tline
-                    }
-                    if align is not None:
-                        example['align'] = align.decode('utf-8')
-                    if features:
-                        example["src_feats"] = dict()
-                        for j, feat in enumerate(features):
-                            example["src_feats"][features_names[j]] = \
-                                feat.decode("utf-8")
-                    yield example
+                    yield self._make_example(sline, tline, align, features)
         for f in features_files:
             f.close()
 
+    def _make_example(self, sline, tline, align, features):
+        sline = sline.decode('utf-8')
+        tline = tline.decode('utf-8')
+        # 'src_original' and 'tgt_original' store the
+        # original line before tokenization. These
+        # fields are used later on in the feature
+        # transforms.
+        example = {
+            'src': sline,
+            'tgt': tline,
+            'src_original': sline,
+            'tgt_original': tline
+        }
+        if align is not None:
+            example['align'] = align.decode('utf-8')
+        if features:
+            example["src_feats"] = dict()
+            for feat_name, feat in zip(self.src_feats.keys(), features):
+                example["src_feats"][feat_name] = feat.decode("utf-8")
+        return example
+
+    def _get_line_numbers(self, n_lines, offset, stride):
+        if self.line_numbers is None:
+            return range(offset, n_lines, stride)
+        return self.line_numbers[offset::stride]
+
+    def _load_indexed(self, offset, stride):
+        """Same as `load`, only reading the lines to iterate on by seeking."""
+        indexes = [LineIndex(path) for path in self._paths()]
+        line_numbers = self._get_line_numbers(
+            min(len(index) for index in indexes), offset, stride)
+        src_lines, tgt_lines, *other_lines = [
+            index.read_lines(line_numbers) for index in indexes]
+        align_lines = other_lines.pop(0) if self.align is not None \
+            else repeat(None)
+        for sline, tline, align, *features in \
+                zip(src_lines, tgt_lines, align_lines, *other_lines):
+            yield self._make_example(sline, tline, align, features)
+
+    def _load_binary(self, offset, stride):
+        """Same as `load`, with lines read already split into tokens."""
+        src_corpus, tgt_corpus = BinaryCorpus(self.src), BinaryCorpus(self.tgt)
+        n_lines = min(len(src_corpus), len(tgt_corpus))
+        for i in self._get_line_numbers(n_lines, offset, stride):
+            src_tokens, tgt_tokens = src_corpus[i], tgt_corpus[i]
+            yield {
+                'src': src_tokens,
+                'tgt': tgt_tokens,
+                'src_original': list(src_tokens),
+                'tgt_original': list(tgt_tokens)
+            }
+
     def __str__(self):
         cls_name = type(self).__name__
         return '{}({}, {}, align={}, src_feats={})'.format(
             cls_name, self.src, self.tgt, self.align, self.src_feats)
 
 
+def read_line_numbers(path):
+    """Line numbers of a corpus view, from a .npy file or one per line."""
+    if path.endswith('.npy'):
+        return np.load(path)
+    return np.loadtxt(path, dtype=np.int64, ndmin=1)
+
+
+def _newline_aligned_offsets(path, n_chunks):
+    """Byte offsets splitting `path` in up to `n_chunks` slices of lines."""
+    file_size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        for k in range(1, n_chunks):
+            position = max(k * file_size // n_chunks, offsets[-1])
+            if position == 0:
+                continue
+            f.seek(position - 1)  # a line starting at position is kept
+            position = position - 1 + len(f.readline())
+            if offsets[-1] < position < file_size:
+                offsets.append(position)
+    offsets.append(file_size)
+    return offsets
+
+
+def _count_lines_before(path, offsets, block_size=1 << 20):
+    """Number of lines of `path` before each of the sorted byte `offsets`."""
+    counts = []
+    n_lines, position = 0, 0
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            while position < offset:
+                block = f.read(min(block_size, offset - position))
+                if not block:
+                    break
+                n_lines += block.count(b'\n')
+                position += len(block)
+            counts.append(n_lines)
+    return counts
+
+
+def _line_start_offsets(path, line_numbers, block_size=1 << 20):
+    """Byte offsets of the sorted `line_numbers` of `path` (or its size)."""
+    file_size = os.path.getsize(path)
+    offsets = []
+    n_lines, position = 0, 0
+    with open(path, 'rb') as f:
+        block = b''
+        for line_number in line_numbers:
+            while n_lines + block.count(b'\n') < line_number:
+                n_lines += block.count(b'\n')
+                position += len(block)
+                block = f.read(block_size)
+                if not block:
+                    break
+            if not block and n_lines < line_number:
+                offsets.append(file_size)  # fewer lines than asked for
+                continue
+            index = 0
+            for _ in range(line_number - n_lines):
+                index = block.index(b'\n', index) + 1
+            offsets.append(position + index)
+    offsets[-1] = file_size  # the last chunk reads until the end
+    return offsets
+
+
+def _read_byte_range(f, start, end):
+    """Yield the lines of binary file `f` between byte `start` and `end`."""
+    f.seek(start)
+    position = start
+    while position < end:
+        line = f.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line
+
+
 def get_corpora(opts, is_train=False):
     corpora_dict = {}
     if is_train:
@@ -185,6 +391,9 @@ def get_corpora(opts, is_train=False):
                     corpus_dict["path_tgt"],
                     corpus_dict["path_align"],
                     corpus_dict["src_feats"])
+                if corpus_dict.get("path_lines") is not None:
+                    corpora_dict[corpus_id] = corpora_dict[corpus_id].view(
+                        read_line_numbers(corpus_dict["path_lines"]))
     else:
         if CorpusName.VALID in opts.data.keys():
             corpora_dict[CorpusName.VALID] = ParallelCorpus(
@@ -206,11 +415,16 @@ class ParallelCorpusIterator(object):
         transform (TransformPipe): transforms to be applied to corpus;
         skip_empty_level (str): security level when encouter empty line;
         stride (int): iterate corpus with this line stride;
-        offset (int): iterate corpus with this line offset.
+        offset (int): iterate corpus with this line offset;
+        shuffle (dict|None): if given, `ParallelCorpus.shuffled` kwargs but
+            the seed, which is `seed` plus the number of previous epochs,
+            so that all strided iterators share the order of each epoch;
+        seed (int): base seed of the shuffled orders.
     """
 
     def __init__(self, corpus, transform,
-                 skip_empty_level='warning', stride=1, offset=0):
+                 skip_empty_level='warning', stride=1, offset=0,
+                 shuffle=None, seed=0):
         self.cid = corpus.id
         self.corpus = corpus
         self.transform = transform
@@ -220,9 +434,15 @@ class ParallelCorpusIterator(object):
         self.skip_empty_level = skip_empty_level
         self.stride = stride
         self.offset = offset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
 
     def _tokenize(self, stream):
         for example in stream:
+            if isinstance(example['src'], list):  # binary corpus, split yet
+                yield example
+                continue
             example['src'] = example['src'].strip('\n').split()
             example['tgt'] = example['tgt'].strip('\n').split()
             example['src_original'] = \
@@ -253,10 +473,10 @@ class ParallelCorpusIterator(object):
                 )
             )
 
-    def _add_index(self, stream):
+    def _add_index(self, stream, corpus):
         for i, item in enumerate(stream):
             example = item[0]
-            line_number = i * self.stride + self.offset
+            line_number = corpus.line_number(i * self.stride + self.offset)
             example['indices'] = line_number
             if (len(example['src']) == 0 or len(example['tgt']) == 0 or
                     ('align' in example and example['align'] == 0)):
@@ -270,17 +490,22 @@ class ParallelCorpusIterator(object):
             yield item
 
     def __iter__(self):
-        corpus_stream = self.corpus.load(
+        corpus = self.corpus
+        if self.shuffle is not None:
+            corpus = corpus.shuffled(self.seed + self.epoch, **self.shuffle)
+            self.epoch += 1
+        corpus_stream = corpus.load(
             stride=self.stride, offset=self.offset
         )
         tokenized_corpus = self._tokenize(corpus_stream)
         transformed_corpus = self._transform(tokenized_corpus)
-        indexed_corpus = self._add_index(transformed_corpus)
+        indexed_corpus = self._add_index(transformed_corpus, corpus)
         yield from indexed_corpus
 
 
 def build_corpora_iters(corpora, transforms, corpora_info,
-                        skip_empty_level='warning', stride=1, offset=0):
+                        skip_empty_level='warning', stride=1, offset=0,
+                        shuffle=None, seed=0):
     """Return `ParallelCorpusIterator` for all corpora defined in opts."""
     corpora_iters = dict()
     for c_id, corpus in corpora.items():
@@ -292,7 +517,8 @@ def build_corpora_iters(corpora, transforms, corpora_info,
         logger.info(f"{c_id}'s transforms: {str(transform_pipe)}")
         corpus_iter = ParallelCorpusIterator(
             corpus, transform_pipe,
-            skip_empty_level=skip_empty_level, stride=stride, offset=offset)
+            skip_empty_level=skip_empty_level, stride=stride, offset=offset,
+            shuffle=shuffle, seed=seed)
         corpora_iters[c_id] = corpus_iter
     return corpora_iters
 
@@ -374,6 +600,27 @@ def build_sub_vocab(corpora, transforms, opts, n_sample, stride, offset):
     return sub_counter_src, sub_counter_tgt, sub_counter_src_feats
 
 
+def _use_byte_ranges(opts, corpora, n_sample):
+    """Whether each vocab worker can count its own byte range of the data."""
+    return (opts.vocab_chunking == 'byte_range' and opts.num_threads > 1
+            and n_sample == -1 and not opts.dump_samples
+            and all(corpus.can_split_by_bytes()
+                    for corpus in corpora.values()))
+
+
+def _split_corpora_by_bytes(corpora, n_chunks):
+    """List of `n_chunks` dicts, with the k-th byte range of all corpora."""
+    chunks = {c_name: corpus.split_by_bytes(n_chunks)
+              for c_name, corpus in corpora.items()}
+    return [{c_name: c_chunks[k] for c_name, c_chunks in chunks.items()
+             if k < len(c_chunks)} for k in range(n_chunks)]
+
+
+def _build_chunk_vocab(transforms, opts, corpora):
+    """Build vocab on byte ranges of the data (see `split_by_bytes`)."""
+    return build_sub_vocab(corpora, transforms, opts, -1, 1, 0)
+
+
 def init_pool(queues):
     """Add the queues as attribute of the pooled function."""
     build_sub_vocab.queues = queues
@@ -408,12 +655,18 @@ def build_vocab(opts, transforms, n_sample=3):
             args=(sample_path, queues),
             daemon=True)
         write_process.start()
-    with mp.Pool(opts.num_threads, init_pool, [queues]) as p:
+    if _use_byte_ranges(opts, corpora, n_sample):
+        logger.info("Counting vocab on newline-aligned byte ranges.")
+        func = partial(_build_chunk_vocab, transforms, opts)
+        jobs = _split_corpora_by_bytes(corpora, opts.num_threads)
+    else:
         func = partial(
             build_sub_vocab, corpora, transforms,
             opts, n_sample, opts.num_threads)
+        jobs = range(0, opts.num_threads)
+    with mp.Pool(opts.num_threads, init_pool, [queues]) as p:
         for sub_counter_src, sub_counter_tgt, sub_counter_src_feats in p.imap(
-                func, range(0, opts.num_threads)):
+                func, jobs):
             counter_src.update(sub_counter_src)
             counter_tgt.update(sub_counter_tgt)
             counter_src_feats.update(sub_counter_src_feats)
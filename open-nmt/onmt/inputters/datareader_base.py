@@ -28,7 +28,12 @@ class DataReaderBase(object):
 
     @classmethod
     def _read_file(cls, path):
-        """Line-by-line read a file as bytes."""
+        """Line-by-line read a file as bytes (or as str for binary corpora)."""
+        from onmt.inputters.binary_corpus import BinaryCorpus, \
+            has_binary_corpus
+        if has_binary_corpus(path):
+            yield from BinaryCorpus(path).iter_text()
+            return
         with open(path, "rb") as f:
             for line in f:
                 yield line
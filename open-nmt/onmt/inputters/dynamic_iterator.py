@@ -100,7 +100,10 @@ class DynamicDatasetIter(object):
         pool_factor (int): accum this number of batch before sorting;
         skip_empty_level (str): security level when encouter empty line;
         stride (int): iterate data files with this stride;
-        offset (int): iterate data files with this offset.
+        offset (int): iterate data files with this offset;
+        shuffle (dict|None): order in which training corpora are read at
+            each epoch (see `ParallelCorpusIterator`), None for file order;
+        seed (int): base seed of the shuffled orders.
 
     Attributes:
         batch_size_fn (function): functions to calculate batch_size;
@@ -112,7 +115,8 @@ class DynamicDatasetIter(object):
     def __init__(self, corpora, corpora_info, transforms, fields, is_train,
                  batch_type, batch_size, batch_size_multiple, data_type="text",
                  bucket_size=2048, pool_factor=8192,
-                 skip_empty_level='warning', stride=1, offset=0):
+                 skip_empty_level='warning', stride=1, offset=0,
+                 shuffle=None, seed=0):
         self.corpora = corpora
         self.transforms = transforms
         self.fields = fields
@@ -130,6 +134,8 @@ class DynamicDatasetIter(object):
             raise ValueError(f"Invalid argument for stride={stride}.")
         self.stride = stride
         self.offset = offset
+        self.shuffle = shuffle if is_train else None
+        self.seed = seed
         if skip_empty_level not in ['silent', 'warning', 'error']:
             raise ValueError(
                 f"Invalid argument skip_empty_level={skip_empty_level}")
@@ -144,19 +150,29 @@ class DynamicDatasetIter(object):
             batch_size_multiple = opts.batch_size_multiple
         else:
             batch_size_multiple = 8 if opts.model_dtype == "fp16" else 1
+        shuffle = None
+        shuffle_corpus = getattr(opts, 'shuffle_corpus', 'none')
+        if shuffle_corpus != 'none':
+            block_size = opts.shuffle_block_size \
+                if shuffle_corpus == 'block' else 1
+            window_size = opts.shuffle_window \
+                if shuffle_corpus == 'block' else 1
+            shuffle = {'block_size': block_size, 'window_size': window_size}
         return cls(
             corpora, opts.data, transforms, fields, is_train, opts.batch_type,
             batch_size, batch_size_multiple, data_type=opts.data_type,
             bucket_size=opts.bucket_size, pool_factor=opts.pool_factor,
             skip_empty_level=opts.skip_empty_level,
-            stride=stride, offset=offset
+            stride=stride, offset=offset,
+            shuffle=shuffle, seed=max(opts.seed, 0)
         )
 
     def _init_datasets(self):
         datasets_iterables = build_corpora_iters(
             self.corpora, self.transforms, self.corpora_info,
             skip_empty_level=self.skip_empty_level,
-            stride=self.stride, offset=self.offset)
+            stride=self.stride, offset=self.offset,
+            shuffle=self.shuffle, seed=self.seed)
         self.dataset_adapter = DatasetAdapter(self.fields, self.is_train)
         datasets_weights = {
             ds_name: int(self.corpora_info[ds_name]['weight'])
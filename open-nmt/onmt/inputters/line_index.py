@@ -0,0 +1,95 @@
+"""Persisted line-offset index of a text corpus file.
+
+A text file ``<name>.txt`` can be indexed next to itself as ``<name>.idx``,
+a raw int64 array of ``n_lines + 1`` byte offsets: the start of every line,
+then the file size. Any list of line numbers is then read by seeking, which
+lets shards, subsets and shuffled orders of a corpus read only their lines.
+"""
+import os
+
+import numpy as np
+
+
+def line_index_path(path):
+    """Return the index path of text file ``path``."""
+    return os.path.splitext(path)[0] + '.idx'
+
+
+def has_line_index(path):
+    """Whether an up-to-date line index exists for text file ``path``."""
+    if path is None:
+        return False
+    index_path = line_index_path(path)
+    return os.path.exists(index_path) and os.path.exists(path)\
+        and os.path.getmtime(path) <= os.path.getmtime(index_path)
+
+
+def compute_line_offsets(path, block_size=1 << 22):
+    """Byte offsets of all lines of ``path``, followed by its size."""
+    offsets, position = [np.zeros(1, dtype=np.int64)], 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            newlines = np.flatnonzero(
+                np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            offsets.append(newlines.astype(np.int64) + position + 1)
+            position += len(block)
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != position:  # last line without a final newline
+        offsets = np.append(offsets, np.int64(position))
+    return offsets
+
+
+def shuffled_line_numbers(n_lines, seed, block_size=1, window_size=1):
+    """Random order of ``range(n_lines)``, as an int64 array.
+
+    Blocks of ``block_size`` consecutive lines are taken in a random order,
+    then the lines of every ``window_size`` consecutive blocks are mixed
+    together. Reads stay local to a few regions of a file at a time, while
+    consecutive lines (e.g., augmented copies of a reaction) are spread.
+    With ``block_size=1``, this is a global shuffle.
+    """
+    rng = np.random.RandomState(seed)
+    n_blocks = -(-n_lines // block_size)
+    order = (rng.permutation(n_blocks)[:, None] * block_size
+             + np.arange(block_size)).ravel()
+    order = order[order < n_lines]
+    window_lines = block_size * window_size
+    if window_lines > 1:
+        for start in range(0, len(order), window_lines):
+            rng.shuffle(order[start:start + window_lines])
+    return order.astype(np.int64)
+
+
+def write_line_index(path):
+    """Store the line offsets of text file ``path`` in its index file."""
+    compute_line_offsets(path).tofile(line_index_path(path))
+
+
+class LineIndex(object):
+    """Random access to the lines of ``path``, through its line offsets.
+
+    The persisted index is memory-mapped if it is up to date, otherwise
+    offsets are computed in memory (one scan of the raw bytes).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if has_line_index(path):
+            self.offsets = np.memmap(line_index_path(path), dtype=np.int64,
+                                     mode='r')
+        else:
+            self.offsets = compute_line_offsets(path)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read_lines(self, line_numbers):
+        """Yield the raw (bytes) lines of ``line_numbers``, in their order."""
+        with open(self.path, 'rb') as f:
+            next_position = None
+            for i in line_numbers:
+                start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+                if start != next_position:  # no seek for consecutive lines
+                    f.seek(start)
+                yield f.read(end - start)
+                next_position = end
@@ -1,7 +1,9 @@
 """ Embeddings module """
 import math
+import os
 import warnings
 
+import numpy as np
 import torch
 import torch.nn as nn
 
@@ -262,10 +264,51 @@ class Embeddings(nn.Module):
 
 # Some utilitary functions for pretrained embeddings
 
+class BinaryEmbeddings(object):
+    """
+    Embeddings saved as a ``.npy`` matrix, whose i-th row is the vector of
+    the i-th token of the ``.tokens`` file saved next to it (one per line).
+    The matrix is memory-mapped, so that no float is ever parsed from text.
+    The first ``skip_rows`` rows are left out and tokens are filtered, as
+    ``skip_lines`` and ``filter_set`` do for text files, so that both
+    formats give the same vectors.
+    """
+
+    def __init__(self, path, skip_rows=0, filter_set=None):
+        self.vectors = np.load(path, mmap_mode='r')
+        tokens_path = os.path.splitext(path)[0] + '.tokens'
+        with open(tokens_path, 'r', encoding='utf-8') as f:
+            tokens = f.read().split('\n')[:-1][skip_rows:]
+        self.n_vectors = len(tokens)
+        self.rows = {token: i for i, token in enumerate(tokens, skip_rows)
+                     if filter_set is None or token in filter_set}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def keys(self):
+        return self.rows.keys()
+
+    def to_torch_tensor(self, vocab):
+        """Gather the rows of all vocab tokens at once into a vocab tensor."""
+        tensor = torch.zeros((len(vocab), self.vectors.shape[1]))
+        matches = [(i, self.rows[word]) for i, word in enumerate(vocab.itos)
+                   if word in self.rows]
+        if len(matches) > 0:
+            vocab_indices, rows = zip(*matches)
+            vectors = np.asarray(self.vectors[list(rows)], dtype=np.float32)
+            tensor[list(vocab_indices)] = torch.from_numpy(vectors)
+        return tensor
+
+
 def read_embeddings(path, skip_lines=0, filter_set=None):
     """
-    Read an embeddings file in the glove format.
+    Read an embeddings file in the glove format,
+    or binary embeddings if `path` is a ``.npy`` file.
     """
+    if path.endswith('.npy'):
+        embs = BinaryEmbeddings(path, skip_lines, filter_set)
+        return embs, embs.n_vectors
     embs = dict()
     total_vectors_in_file = 0
     with open(path, 'rb') as f:
@@ -297,6 +340,8 @@ def calc_vocab_load_stats(vocab, loaded_embed_dict):
 
 
 def convert_to_torch_tensor(word_to_float_list_dict, vocab):
+    if isinstance(word_to_float_list_dict, BinaryEmbeddings):
+        return word_to_float_list_dict.to_torch_tensor(vocab)
     dim = len(next(iter(word_to_float_list_dict.values())))
     tensor = torch.zeros((len(vocab), dim))
     for word, values in word_to_float_list_dict.items():
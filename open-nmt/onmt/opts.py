@@ -108,6 +108,13 @@ def _add_dynamic_corpus_opts(parser, build_vocab_only=False):
                   "Warning: this may slow down the process.")
         group.add('-num_threads', '--num_threads', type=int, default=1,
                   help="Number of parallel threads to build the vocab.")
+        group.add('-vocab_chunking', '--vocab_chunking', type=str,
+                  default='byte_range', choices=['byte_range', 'stride'],
+                  help="How the data is split between vocab threads: "
+                  "'byte_range' lets each thread read only its own slice "
+                  "of lines (full data, no features nor alignments), "
+                  "'stride' lets each thread read all lines and keep "
+                  "every num_threads-th line.")
         group.add('-vocab_sample_queue_size', '--vocab_sample_queue_size',
                   type=int, default=20,
                   help="Size of queues used in the build_vocab dump path.")
@@ -169,7 +176,9 @@ def _add_dynamic_fields_opts(parser, build_vocab_only=False):
         group = parser.add_argument_group('Embeddings')
         group.add('-both_embeddings', '--both_embeddings',
                   help="Path to the embeddings file to use "
-                  "for both source and target tokens.")
+                  "for both source and target tokens. A '.npy' file "
+                  "is read as a binary matrix, with its tokens listed "
+                  "in a '.tokens' file next to it.")
         group.add('-src_embeddings', '--src_embeddings',
                   help="Path to the embeddings file to use for source tokens.")
         group.add('-tgt_embeddings', '--tgt_embeddings',
@@ -634,6 +643,19 @@ def _add_train_dynamic_data(parser):
     group = parser.add_argument_group("Dynamic data")
     group.add("-bucket_size", "--bucket_size", type=int, default=2048,
               help="Examples per dynamically generated torchtext Dataset.")
+    group.add("-shuffle_corpus", "--shuffle_corpus", type=str,
+              default="none", choices=["none", "global", "block"],
+              help="Order in which training corpora are read, reseeded "
+              "at each epoch (and shared by all training processes): "
+              "'none' reads lines in file order, 'global' reads them in "
+              "a random order, 'block' reads random blocks of "
+              "-shuffle_block_size lines, mixing the lines of "
+              "-shuffle_window blocks together. Lines are read by "
+              "seeking, best with line indexes or binary corpora.")
+    group.add("-shuffle_block_size", "--shuffle_block_size", type=int,
+              default=1024, help="Lines per block for -shuffle_corpus block.")
+    group.add("-shuffle_window", "--shuffle_window", type=int, default=16,
+              help="Blocks mixed together for -shuffle_corpus block.")
 
 
 def train_opts(parser):
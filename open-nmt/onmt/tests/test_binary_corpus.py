@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from onmt.inputters.binary_corpus import BinaryCorpus, binary_corpus_paths, \
+    has_binary_corpus, write_binary_corpus
+from onmt.inputters.corpus import ParallelCorpus
+
+
+SRC_LINES = ['C C ( = O ) O . C C O\n', 'O\n', 'c 1 c c c c c 1 Br\n']
+TGT_LINES = ['C C ( = O ) O C C\n', 'O . O\n', 'c 1 c c c c c 1\n']
+
+
+class TestBinaryCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_path = os.path.join(self.tmp_dir, 'src-train.txt')
+        self.tgt_path = os.path.join(self.tmp_dir, 'tgt-train.txt')
+        with open(self.src_path, 'w') as f:
+            f.writelines(SRC_LINES)
+        with open(self.tgt_path, 'w') as f:
+            f.writelines(TGT_LINES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        self.assertFalse(has_binary_corpus(self.src_path))
+        write_binary_corpus(self.src_path)
+        self.assertTrue(has_binary_corpus(self.src_path))
+        corpus = BinaryCorpus(self.src_path)
+        self.assertEqual(len(corpus), len(SRC_LINES))
+        self.assertEqual([corpus[i] for i in range(len(corpus))],
+                         [line.split() for line in SRC_LINES])
+        self.assertEqual(list(corpus.iter_text(offset=1, stride=2)),
+                         [SRC_LINES[1].strip()])
+
+    def test_stale_binary_corpus(self):
+        write_binary_corpus(self.src_path)
+        ids_path = binary_corpus_paths(self.src_path)[0]
+        old_mtime = os.path.getmtime(ids_path) - 10
+        for path in binary_corpus_paths(self.src_path):
+            os.utime(path, (old_mtime, old_mtime))
+        self.assertFalse(has_binary_corpus(self.src_path))
+
+    def test_parallel_corpus_load(self):
+        corpus = ParallelCorpus('corpus_1', self.src_path, self.tgt_path)
+        text_examples = list(corpus.load(offset=0, stride=2))
+        write_binary_corpus(self.src_path)
+        write_binary_corpus(self.tgt_path)
+        self.assertTrue(corpus.is_binary())
+        binary_examples = list(corpus.load(offset=0, stride=2))
+        self.assertEqual(len(text_examples), len(binary_examples))
+        for text_ex, binary_ex in zip(text_examples, binary_examples):
+            self.assertEqual(text_ex['src'].split(), binary_ex['src'])
+            self.assertEqual(text_ex['tgt'].split(), binary_ex['tgt'])
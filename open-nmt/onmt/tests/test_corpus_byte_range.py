@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from onmt.inputters.corpus import ParallelCorpus
+
+
+SRC_LINES = ['C C O', '', 'c 1 c c c c c 1', 'N', 'O = C = O', 'Cl']
+TGT_LINES = ['C', 'O O', '', 'N N N', 'C', 'Br', 'extra']
+
+
+class TestCorpusByteRange(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_path = os.path.join(self.tmp_dir, 'src-train.txt')
+        self.tgt_path = os.path.join(self.tmp_dir, 'tgt-train.txt')
+        with open(self.src_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(SRC_LINES) + '\n')
+        with open(self.tgt_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(TGT_LINES))  # no trailing newline
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_split_by_bytes_covers_all_lines(self):
+        corpus = ParallelCorpus('corpus_1', self.src_path, self.tgt_path)
+        self.assertTrue(corpus.can_split_by_bytes())
+        all_examples = list(corpus.load())
+        for n_chunks in range(1, 10):
+            chunks = corpus.split_by_bytes(n_chunks)
+            self.assertLessEqual(len(chunks), n_chunks)
+            chunk_examples = [example for chunk in chunks
+                              for example in chunk.load()]
+            self.assertEqual(chunk_examples, all_examples)
+            first_lines = [chunk.first_line for chunk in chunks]
+            self.assertEqual(first_lines, sorted(set(first_lines)))
+            self.assertEqual(first_lines[0], 0)
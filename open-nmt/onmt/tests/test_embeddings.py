@@ -1,9 +1,14 @@
 import unittest
-from onmt.modules.embeddings import Embeddings
+from onmt.modules.embeddings import Embeddings, read_embeddings, \
+    convert_to_torch_tensor
 
 import itertools
+import os
+import shutil
+import tempfile
 from copy import deepcopy
 
+import numpy as np
 import torch
 
 from onmt.tests.utils_for_tests import product_dict
@@ -146,3 +151,53 @@ class TestEmbeddings(unittest.TestCase):
                         trainable_params[param_name]
                         .ne(old_weights[param_name]).any(),
                         param_name + " " + init_case.__str__())
+
+
+class _Vocab(object):
+    def __init__(self, itos):
+        self.itos = itos
+        self.stoi = {word: i for i, word in enumerate(itos)}
+
+    def __len__(self):
+        return len(self.itos)
+
+
+class TestBinaryEmbeddings(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.npy_path = os.path.join(self.tmp_dir, 'w2v-embeddings.npy')
+        self.vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+        np.save(self.npy_path, self.vectors)
+        with open(os.path.join(self.tmp_dir, 'w2v-embeddings.tokens'),
+                  'w') as f:
+            f.writelines(['C\n', 'O\n', '(\n', ')\n'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_binary_embeddings_to_vocab_tensor(self):
+        vocab = _Vocab(['<unk>', '<blank>', 'O', 'N', 'C'])
+        embs, total_vec_count = read_embeddings(self.npy_path)
+        self.assertEqual(total_vec_count, 4)
+        tensor = convert_to_torch_tensor(embs, vocab)
+        self.assertEqual(tuple(tensor.shape), (5, 3))
+        self.assertTrue(tensor[2].eq(torch.from_numpy(self.vectors[1])).all())
+        self.assertTrue(tensor[4].eq(torch.from_numpy(self.vectors[0])).all())
+        self.assertTrue(tensor[3].eq(0).all())
+
+    def test_binary_and_text_embeddings_match(self):
+        txt_path = os.path.join(self.tmp_dir, 'w2v-embeddings.txt')
+        with open(txt_path, 'w') as f:  # as written by the data generator
+            for token, vector in zip(['C', 'O', '(', ')'], self.vectors):
+                f.write(token + ' ' + ' '.join(map(str, vector)) + '\n')
+        vocab = _Vocab(['<unk>', '<blank>', 'O', 'N', 'C', ')'])
+        for skip_lines in [0, 1]:  # 1 for embeddings_type word2vec
+            npy_embs, npy_count = read_embeddings(
+                self.npy_path, skip_lines, set(vocab.stoi))
+            txt_embs, txt_count = read_embeddings(
+                txt_path, skip_lines, set(vocab.stoi))
+            self.assertEqual(npy_count, txt_count)
+            self.assertEqual(set(npy_embs.keys()), set(txt_embs.keys()))
+            self.assertTrue(convert_to_torch_tensor(npy_embs, vocab).eq(
+                convert_to_torch_tensor(txt_embs, vocab)).all())
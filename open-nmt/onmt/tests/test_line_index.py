@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from onmt.inputters.corpus import ParallelCorpus
+from onmt.inputters.line_index import LineIndex, compute_line_offsets, \
+    has_line_index, shuffled_line_numbers, write_line_index
+
+
+SRC_LINES = ['C C O', 'N', '', 'c 1 c c c c c 1', 'O = C = O', 'Cl']
+TGT_LINES = ['C', 'O O', 'N N', 'c 1 c c c c c 1 Br', 'C', 'Br']
+
+
+class TestLineIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_path = os.path.join(self.tmp_dir, 'src-train.txt')
+        self.tgt_path = os.path.join(self.tmp_dir, 'tgt-train.txt')
+        with open(self.src_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(SRC_LINES) + '\n')
+        with open(self.tgt_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(TGT_LINES))  # no trailing newline
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_lines(self):
+        self.assertEqual(len(compute_line_offsets(self.tgt_path)),
+                         len(TGT_LINES) + 1)
+        self.assertFalse(has_line_index(self.src_path))
+        write_line_index(self.src_path)
+        self.assertTrue(has_line_index(self.src_path))
+        index = LineIndex(self.src_path)
+        self.assertEqual(len(index), len(SRC_LINES))
+        lines = list(index.read_lines([5, 0, 1, 3]))
+        self.assertEqual(lines, [(SRC_LINES[i] + '\n').encode('utf-8')
+                                 for i in [5, 0, 1, 3]])
+
+    def test_parallel_corpus_views(self):
+        corpus = ParallelCorpus('corpus_1', self.src_path, self.tgt_path)
+        scanned = list(corpus.load(offset=1, stride=2))
+        write_line_index(self.src_path)
+        write_line_index(self.tgt_path)
+        self.assertTrue(corpus.is_indexed())
+        self.assertEqual(list(corpus.load(offset=1, stride=2)), scanned)
+        all_examples = list(corpus.load())
+        view = corpus.view([4, 1, 2])
+        self.assertEqual(list(view.load()),
+                         [all_examples[i] for i in [4, 1, 2]])
+        self.assertEqual([view.line_number(i) for i in range(3)], [4, 1, 2])
+        self.assertEqual(corpus.line_number(3), 3)
+        shuffled = list(corpus.shuffled(seed=1234).load())
+        self.assertEqual(list(corpus.shuffled(seed=1234).load()), shuffled)
+        self.assertCountEqual([e['src'] for e in shuffled],
+                              [e['src'] for e in all_examples])
+
+    def test_shuffled_line_numbers(self):
+        for block_size, window_size in [(1, 1), (2, 1), (3, 2), (64, 4)]:
+            order = shuffled_line_numbers(100, 1234, block_size, window_size)
+            self.assertEqual(sorted(order.tolist()), list(range(100)))
+            self.assertEqual(
+                order.tolist(),
+                shuffled_line_numbers(100, 1234, block_size,
+                                      window_size).tolist())
+        self.assertNotEqual(shuffled_line_numbers(100, 1).tolist(),
+                            shuffled_line_numbers(100, 2).tolist())
+
+    def test_strided_shuffled_epochs(self):
+        corpus = ParallelCorpus('corpus_1', self.src_path, self.tgt_path)
+        all_srcs = sorted(e['src'] for e in corpus.load())
+        for seed in [1, 2]:
+            shuffled = corpus.shuffled(seed, block_size=2, window_size=2)
+            strided_srcs = [e['src'] for offset in range(3)
+                            for e in shuffled.load(offset=offset, stride=3)]
+            self.assertEqual(sorted(strided_srcs), all_srcs)
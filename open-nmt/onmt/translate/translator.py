@@ -20,16 +20,24 @@ from onmt.modules.copy_generator import collapse_copy_scores
 from onmt.constants import ModelTask
 
 
-def build_translator(opt, report_score=True, logger=None, out_file=None):
-    if out_file is None:
-        out_file = codecs.open(opt.output, "w+", "utf-8")
-
+def load_translation_model(opt):
+    """Load the (fields, model, model_opt) used by :func:`build_translator`."""
     load_test_model = (
         onmt.decoders.ensemble.load_test_model
         if len(opt.models) > 1
         else onmt.model_builder.load_test_model
     )
-    fields, model, model_opt = load_test_model(opt)
+    return load_test_model(opt)
+
+
+def build_translator(opt, report_score=True, logger=None, out_file=None,
+                     loaded_model=None):
+    if out_file is None:
+        out_file = codecs.open(opt.output, "w+", "utf-8")
+
+    if loaded_model is None:
+        loaded_model = load_translation_model(opt)
+    fields, model, model_opt = loaded_model
 
     scorer = onmt.translate.GNMTGlobalScorer.from_opt(opt)
 
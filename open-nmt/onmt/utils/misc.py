@@ -32,15 +32,23 @@ def split_corpus(path, shard_size, default=None):
 def _split_corpus(path, shard_size):
     """Yield a `list` containing `shard_size` line of `path`.
     """
-    with open(path, "rb") as f:
-        if shard_size <= 0:
-            yield f.readlines()
-        else:
-            while True:
-                shard = list(islice(f, shard_size))
-                if not shard:
-                    break
-                yield shard
+    from onmt.inputters.binary_corpus import BinaryCorpus, has_binary_corpus
+    if has_binary_corpus(path):
+        yield from _split_lines(BinaryCorpus(path).iter_text(), shard_size)
+    else:
+        with open(path, "rb") as f:
+            yield from _split_lines(f, shard_size)
+
+
+def _split_lines(lines, shard_size):
+    if shard_size <= 0:
+        yield list(lines)
+    else:
+        while True:
+            shard = list(islice(lines, shard_size))
+            if not shard:
+                break
+            yield shard
 
 
 def aeq(*args):
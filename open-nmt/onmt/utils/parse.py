@@ -62,6 +62,12 @@ class DataOptsCheckerMixin(object):
                 corpus['path_align'] = None
             else:
                 cls._validate_file(path_align, info=f'{cname}/path_align')
+            # Check line numbers: optional view on a subset of the corpus
+            path_lines = corpus.get('path_lines', None)
+            if path_lines is None:
+                corpus['path_lines'] = None
+            else:
+                cls._validate_file(path_lines, info=f'{cname}/path_lines')
             # Check prefix: will be used when use prefix transform
             src_prefix = corpus.get('src_prefix', None)
             tgt_prefix = corpus.get('tgt_prefix', None)
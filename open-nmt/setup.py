@@ -35,6 +35,7 @@ setup(
             "onmt_server=onmt.bin.server:main",
             "onmt_train=onmt.bin.train:main",
             "onmt_translate=onmt.bin.translate:main",
+            "onmt_translate_many=onmt.bin.translate_many:main",
             "onmt_release_model=onmt.bin.release_model:main",
             "onmt_average_models=onmt.bin.average_models:main",
             "onmt_build_vocab=onmt.bin.build_vocab:main"
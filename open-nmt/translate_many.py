@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+from onmt.bin.translate_many import main
+
+
+if __name__ == "__main__":
+    main()
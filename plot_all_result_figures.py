@@ -1,7 +1,92 @@
-import figures
+import os
+import hashlib
+import sqlite3
+import importlib
+import traceback
+from contextlib import closing
+from multiprocessing import Pool
+import matplotlib
+matplotlib.use('agg')  # figures are rendered by worker processes
+from sample_store import hash_file
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-f', '--figures', nargs='+', default=None)
+parser.add_argument('-w', '--workers', default=4, type=int)
+parser.add_argument('--force', action='store_true')
+args = parser.parse_args()
 
 
-figures.fig2.do_plot()
-figures.fig3.do_plot()
-figures.fig4.do_plot()
-figures.fig5.do_plot()
+FIGURES = ['fig2', 'fig3', 'fig4', 'fig5']
+FIGURES_DIR = os.path.abspath('figures')
+STAMPS_PATH = os.path.join(FIGURES_DIR, 'figure_stamps.sqlite')
+N_WORKERS = args.workers
+FORCE = args.force  # True -> plot figures even if their inputs did not change
+
+
+def main():
+    """ Plot figures in parallel, each one only if its script or one of the
+        files it reads (results, predictions, per-sample results) changed
+        since it was last plotted
+    """
+    figures = args.figures or FIGURES
+    failed = []
+    with closing(open_stamps()) as stamps:
+        keys = {figure: compute_figure_key(figure) for figure in figures}
+        to_plot = [figure for figure in figures
+                   if FORCE or not is_up_to_date(figure, keys[figure], stamps)]
+        for figure in figures:
+            if figure in to_plot: continue
+            print('- Skipped %s (inputs did not change)' % figure)
+        with Pool(max(1, min(N_WORKERS, len(to_plot)))) as pool:
+            for figure, error in pool.imap_unordered(plot_figure, to_plot):
+                if error is not None:
+                    print('- Failed to plot %s:\n%s' % (figure, error))
+                    failed.append(figure)
+                elif keys[figure] is not None:
+                    with stamps:
+                        stamps.execute('INSERT OR REPLACE INTO figure_stamps '
+                                       'VALUES (?, ?)', (figure, keys[figure]))
+    if len(failed) > 0:
+        raise SystemExit('Failed figures: %s' % ', '.join(sorted(failed)))
+
+
+def plot_figure(figure):
+    try:
+        import_figure(figure).do_plot()
+        return figure, None
+    except Exception:  # reported by the parent, other figures keep going
+        return figure, traceback.format_exc()
+
+
+def import_figure(figure):
+    return importlib.import_module('figures.%s.%s' % (figure, figure))
+
+
+def compute_figure_key(figure):
+    # Hash of the figure script and of all its inputs (None if one is missing)
+    module = import_figure(figure)
+    figure_hash = hashlib.sha256()
+    for path in [module.__file__] + module.get_input_paths():
+        if not os.path.isfile(path):
+            return None
+        figure_hash.update(('%s %s\n' % (os.path.abspath(path),
+                                         hash_file(path))).encode('utf-8'))
+    return figure_hash.hexdigest()
+
+
+def is_up_to_date(figure, key, stamps):
+    if key is None: return False  # some input is missing, the figure will tell
+    row = stamps.execute('SELECT figure_key FROM figure_stamps '
+                         'WHERE figure = ?', (figure,)).fetchone()
+    return row is not None and row[0] == key
+
+
+def open_stamps():
+    stamps = sqlite3.connect(STAMPS_PATH)
+    stamps.execute('CREATE TABLE IF NOT EXISTS figure_stamps '
+                   '(figure TEXT PRIMARY KEY, figure_key TEXT NOT NULL)')
+    return stamps
+
+
+if __name__ == '__main__':
+    main()
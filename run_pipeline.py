@@ -0,0 +1,352 @@
+import os
+import hashlib
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+from local_scheduler import ScheduledJob, run_scheduled_jobs
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-r', '--reduce', default=1.0, type=float)
+parser.add_argument('-w', '--workers', default=1, type=int)
+parser.add_argument('-n', '--nested', action='store_true')
+parser.add_argument('-b', '--binary', action='store_true')
+parser.add_argument('-i', '--index', action='store_true')
+parser.add_argument('-s', '--stages', nargs='+', default=None)
+parser.add_argument('-d', '--dry_run', action='store_true')
+parser.add_argument('-c', '--cpus', default=os.cpu_count(), type=int)
+parser.add_argument('-m', '--memory', default=64, type=int)  # in GB
+parser.add_argument('-g', '--gpus', default=1, type=int)
+parser.add_argument('--retries', default=1, type=int)
+args = parser.parse_args()
+
+
+DATA_DIR = os.path.abspath('data')
+ORIGINAL_DIR = os.path.join(DATA_DIR, 'original')
+CONFIGS_DIR = os.path.abspath('configs')
+LOGS_DIR = os.path.abspath('logs')
+RESULTS_DIR = os.path.abspath('results')
+STAMPS_PATH = os.path.abspath('pipeline_stamps.sqlite')
+JOURNAL_PATH = os.path.join(LOGS_DIR, 'pipeline_journal.jsonl')
+TRAIN_SCRIPT = 'python open-nmt/train.py'
+TRANSLATE_SCRIPT = 'python open-nmt/translate_many.py'
+TASKS = [
+    'product-pred',
+    'product-pred-noreag',
+    'reactant-pred',
+    'reactant-pred-noreag',
+    'reactant-pred-single',
+    'reagent-pred'
+]
+TEST_MODES = ['test', 'test-50k']
+ROUNDTRIP_MODES = ['roundtrip', 'roundtrip-50k']
+DATASET_FLAGS = '-r %s' % args.reduce\
+              + (' -n' if args.nested else '') + (' -b' if args.binary else '')\
+              + (' -i' if args.index else '')
+WORKER_FLAGS = ' -w %s' % args.workers  # same outputs whatever the workers
+REDUCED_LINES_FILE = 'lines-train-r%s.npy' % args.reduce  # reduced data view
+HASH_BLOCK_SIZE = 1 << 20  # bytes read at once when hashing a file
+DRY_RUN = args.dry_run  # True -> only print the jobs that are out of date
+SCRIPT_RESOURCES = {'cpus': 1, 'memory': 0, 'gpus': 0}
+WORKERS_RESOURCES = {'cpus': args.workers, 'memory': 0, 'gpus': 0}
+TRAIN_RESOURCES = {'cpus': 2, 'memory': 16, 'gpus': 1}  # as in base_slurm.sh
+TRANSLATE_RESOURCES = {'cpus': 2, 'memory': 8, 'gpus': 1}
+Job = namedtuple('Job', ['name', 'command', 'inputs', 'outputs', 'params',
+                         'run_flags', 'resources', 'log_path'])
+Job.__new__.__defaults__ = ('', SCRIPT_RESOURCES, None)  # run_flags are not
+                                                         # in the job key
+
+
+def main():
+    """ Run all pipeline stages in order, each stage being a list of jobs whose
+        key hashes their command, parameters and the content of their inputs;
+        a job is skipped if its outputs exist and its key did not change, and
+        the other jobs of a stage run concurrently (see local_scheduler)
+    """
+    stages_to_run = args.stages or list(STAGES.keys())
+    with closing(open_stamps()) as stamps:
+        for stage in STAGES:
+            if stage not in stages_to_run: continue
+            jobs = STAGES[stage]()  # built now, from previous stages' outputs
+            run_stage(stage, jobs, stamps)
+    print('Pipeline is up to date!' if not DRY_RUN else 'Dry run done!')
+
+
+def generate_dataset_jobs():
+    # All tasks in one run, which builds the molecule table they share once
+    original_files = [os.path.join(ORIGINAL_DIR, f)
+                      for f in sorted(os.listdir(ORIGINAL_DIR))
+                      if os.path.isfile(os.path.join(ORIGINAL_DIR, f))
+                      and not f.startswith('base_')]
+    scripts = ['generate_all_datasets.py', 'atom_tokenizer.py']
+    return [Job(name='datasets',
+                command='python generate_all_datasets.py %s' % DATASET_FLAGS,
+                inputs=original_files + scripts,
+                outputs=[os.path.join(DATA_DIR, task) for task in TASKS],
+                params=[],
+                run_flags=WORKER_FLAGS,
+                resources=WORKERS_RESOURCES)]
+
+
+def generate_train_config_jobs():
+    data_folders = [os.path.relpath(folder, DATA_DIR)
+                    for folder, subfolders, _ in sorted(os.walk(DATA_DIR))
+                    if len(subfolders) == 0 and 'original' not in folder]
+    return [Job(name='train configs',
+                command='python write_train_configs.py -r %s' % args.reduce,
+                inputs=[os.path.join(ORIGINAL_DIR, 'base_train.yml'),
+                        'write_train_configs.py'],
+                outputs=[CONFIGS_DIR],
+                params=data_folders)]
+
+
+def generate_vocab_jobs():
+    # Vocabs are built and cached by write_vocab_and_slurm_files.py, which
+    # only builds the vocabs of the training corpora it never saw
+    config_paths = find_train_configs()
+    data_folders = sorted({get_data_folder(path) for path in config_paths})
+    return [Job(name='vocabs',
+                command='python write_vocab_and_slurm_files.py -v -r %s'
+                        % args.reduce,
+                inputs=['write_vocab_and_slurm_files.py'] + config_paths
+                       + [path for data_folder in data_folders
+                          for path in get_train_data(data_folder)],
+                outputs=[os.path.join(data_folder, 'src_vocab.vocab')
+                         for data_folder in data_folders],
+                params=[],
+                run_flags=WORKER_FLAGS,
+                resources=WORKERS_RESOURCES)]
+
+
+def generate_model_jobs():
+    jobs = []
+    for config_path in find_train_configs():
+        data_folder = get_data_folder(config_path)
+        logs_folder = os.path.dirname(config_path).replace(CONFIGS_DIR,
+                                                           LOGS_DIR)
+        inputs = [config_path, os.path.join(data_folder, 'src_vocab.vocab')]\
+               + get_train_data(data_folder)
+        if 'pre-trained' in config_path:
+            inputs.extend([os.path.join(data_folder, 'w2v-embeddings.npy'),
+                           os.path.join(data_folder, 'w2v-embeddings.tokens')])
+        jobs.append(Job(name='model %s' % os.path.relpath(config_path),
+                        command='%s -config %s' % (TRAIN_SCRIPT, config_path),
+                        inputs=inputs,
+                        outputs=[os.path.join(logs_folder, 'ckpts')],
+                        params=[],
+                        resources=TRAIN_RESOURCES,
+                        log_path=os.path.join(logs_folder, 'train.out')))
+    return jobs
+
+
+def generate_test_config_jobs():
+    return generate_translate_config_jobs('-t')
+
+
+def generate_roundtrip_config_jobs():
+    return generate_translate_config_jobs('-r')
+
+
+def generate_translate_config_jobs(flag):
+    # Configs only hold paths: they change with the selected checkpoints and,
+    # for roundtrips, with the test predictions they are written from
+    ckpt_paths, pred_paths = [], []
+    for folder, _, files in sorted(os.walk(LOGS_DIR)):
+        if os.path.split(folder)[-1] == 'ckpts':
+            ckpt_paths.extend(os.path.join(folder, f) for f in sorted(files))
+        pred_paths.extend(os.path.join(folder, '%s_predictions.txt' % mode)
+                          for mode in TEST_MODES
+                          if '%s_predictions.txt' % mode in files)
+    return [Job(name='translate configs %s' % flag,
+                command='python write_test_and_roundtrip_configs.py %s' % flag,
+                inputs=[os.path.join(ORIGINAL_DIR, 'base_test.yml'),
+                        'write_test_and_roundtrip_configs.py']
+                       + (pred_paths if flag == '-r' else []),
+                outputs=[],
+                params=ckpt_paths)]
+
+
+def generate_test_jobs():
+    return generate_translate_jobs('test', TEST_MODES)
+
+
+def generate_roundtrip_jobs():
+    return generate_translate_jobs('roundtrip', ROUNDTRIP_MODES)
+
+
+def generate_translate_jobs(stage, modes):
+    # As in test_and_roundtrip_all_models.py, each checkpoint is loaded once
+    # by translate_many for all the configs (modes) that use it
+    config_paths_by_model = {}
+    for folder, _, files in sorted(os.walk(CONFIGS_DIR)):
+        for mode in modes:
+            if '%s.yml' % mode not in files: continue
+            config_path = os.path.join(folder, '%s.yml' % mode)
+            config_paths_by_model.setdefault(
+                read_config_value(config_path, 'model'), []).append(config_path)
+    jobs = []
+    for model_path, config_paths in config_paths_by_model.items():
+        jobs.append(Job(name='%s %s' % (stage, os.path.relpath(model_path)),
+                        command='%s -configs %s' % (TRANSLATE_SCRIPT,
+                                                    ' '.join(config_paths)),
+                        inputs=[model_path] + config_paths
+                               + [read_config_value(c, 'src')
+                                  for c in config_paths],
+                        outputs=[read_config_value(c, 'output')
+                                 for c in config_paths],
+                        params=[],
+                        resources=TRANSLATE_RESOURCES,
+                        log_path=os.path.join(os.path.dirname(
+                            os.path.dirname(model_path)), '%s.out' % stage)))
+    return jobs
+
+
+def generate_evaluation_jobs():
+    pred_paths, gold_paths = [], []
+    for folder, _, files in sorted(os.walk(LOGS_DIR)):
+        pred_paths.extend(os.path.join(folder, f) for f in sorted(files)
+                          if f.endswith('_predictions.txt'))
+    for folder, _, files in sorted(os.walk(DATA_DIR)):
+        if 'original' in folder: continue
+        gold_paths.extend(os.path.join(folder, f) for f in sorted(files)
+                          if f.startswith(('src-test', 'tgt-test'))
+                          and f.endswith('.txt'))
+    return [Job(name='evaluation',
+                command='python evaluate_all_models.py',
+                inputs=['evaluate_all_models.py'] + pred_paths + gold_paths,
+                outputs=[RESULTS_DIR],
+                params=[])]
+
+
+STAGES = {
+    'datasets': generate_dataset_jobs,
+    'train-configs': generate_train_config_jobs,
+    'vocabs': generate_vocab_jobs,
+    'models': generate_model_jobs,
+    'test-configs': generate_test_config_jobs,
+    'tests': generate_test_jobs,
+    'roundtrip-configs': generate_roundtrip_config_jobs,
+    'roundtrips': generate_roundtrip_jobs,
+    'evaluation': generate_evaluation_jobs,
+}
+
+
+def run_stage(stage, jobs, stamps):
+    print('\nStage %s: %s job(s)' % (stage, len(jobs)))
+    to_run = []
+    for job in jobs:
+        key = compute_job_key(job, stamps)
+        if is_up_to_date(job, key, stamps):
+            continue
+        print('-- Out of date: %s' % job.name)
+        to_run.append((job, key))
+    if DRY_RUN or len(to_run) == 0: return
+
+    # Scheduled names hold the job key, so that the journal only resumes a
+    # job that was interrupted with the same inputs
+    scheduled = {get_scheduled_name(job, key): job for job, key in to_run}
+    failed = run_scheduled_jobs(
+        [ScheduledJob(name=name, command=job.command + job.run_flags,
+                      log_path=job.log_path, **job.resources)
+         for name, job in scheduled.items()],
+        args.cpus, args.memory, args.gpus, JOURNAL_PATH,
+        n_retries=args.retries)
+    for name, job in scheduled.items():
+        if name in failed: continue
+        key = compute_job_key(job, stamps)  # inputs may be written by the job
+        if key is None: continue
+        with stamps:
+            stamps.execute('INSERT OR REPLACE INTO job_stamps VALUES (?, ?)',
+                           (job.name, key))
+    if len(failed) > 0:
+        raise RuntimeError('Failed jobs of stage %s (see %s):\n%s'
+                           % (stage, JOURNAL_PATH, '\n'.join(failed)))
+
+
+def get_scheduled_name(job, key):
+    return '%s (%s)' % (job.name, key[:16] if key is not None else 'no key')
+
+
+def is_up_to_date(job, key, stamps):
+    if key is None: return False  # some input is missing, the job will tell
+    row = stamps.execute('SELECT job_key FROM job_stamps WHERE job_name = ?',
+                         (job.name,)).fetchone()
+    return row is not None and row[0] == key\
+        and all(os.path.exists(path) for path in job.outputs)
+
+
+def compute_job_key(job, stamps):
+    job_hash = hashlib.sha256()
+    for text in [job.command] + list(job.params):
+        job_hash.update(('%s\n' % text).encode('utf-8'))
+    for path in job.inputs:
+        if path is None or not os.path.isfile(path):
+            return None
+        job_hash.update(('%s %s\n' % (path, hash_file(path, stamps)))
+                        .encode('utf-8'))
+    return job_hash.hexdigest()
+
+
+def hash_file(path, stamps):
+    """ Hash the content of a file, which is only read again if its size or its
+        modification time changed since it was last hashed (e.g., checkpoints)
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    row = stamps.execute('SELECT size, mtime, digest FROM file_hashes '
+                         'WHERE path = ?', (path,)).fetchone()
+    if row is not None and tuple(row[:2]) == (stat.st_size, stat.st_mtime_ns):
+        return row[2]
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    with stamps:
+        stamps.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                       (path, stat.st_size, stat.st_mtime_ns,
+                        file_hash.hexdigest()))
+    return file_hash.hexdigest()
+
+
+def open_stamps():
+    stamps = sqlite3.connect(STAMPS_PATH)
+    stamps.execute('CREATE TABLE IF NOT EXISTS job_stamps '
+                   '(job_name TEXT PRIMARY KEY, job_key TEXT NOT NULL)')
+    stamps.execute('CREATE TABLE IF NOT EXISTS file_hashes '
+                   '(path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                   'mtime INTEGER NOT NULL, digest TEXT NOT NULL)')
+    return stamps
+
+
+def find_train_configs():
+    # Run the trainings that take less time first
+    config_paths = [os.path.join(folder, 'train.yml')
+                    for folder, _, files in sorted(os.walk(CONFIGS_DIR))
+                    if 'train.yml' in files]
+    return sorted(config_paths, key=lambda path: int(
+        os.path.basename(get_data_folder(path)).split('x')[-1]))
+
+
+def get_data_folder(config_path):
+    # configs/<task>/<format>/<token>/<fold>/<embed>/train.yml
+    data_folder = os.path.dirname(os.path.dirname(config_path))
+    return data_folder.replace(CONFIGS_DIR, DATA_DIR)
+
+
+def get_train_data(data_folder):
+    train_data = [os.path.join(data_folder, '%s-%s.txt' % (side, split))
+                  for side in ['src', 'tgt'] for split in ['train', 'val']]
+    if args.reduce < 1.0:
+        train_data.append(os.path.join(data_folder, REDUCED_LINES_FILE))
+    return train_data
+
+
+def read_config_value(config_path, key):
+    with open(config_path, 'r') as f:
+        for line in f:
+            if line.startswith('%s:' % key):
+                return line.split(':', 1)[1].strip()
+    return None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import os
+import hashlib
+import numpy as np
+
+
+ROOT_DIR = os.path.split(os.path.abspath(__file__))[0]
+LOGS_DIR = os.path.join(ROOT_DIR, 'logs')
+SAMPLES_DIR = os.path.join(ROOT_DIR, 'results', 'samples')
+SAMPLE_STORE_VERSION = 1  # to increase when stored samples change meaning
+HASH_BLOCK_SIZE = 1 << 20  # bytes read at once when hashing a file
+
+
+def sample_store_path(pred_path):
+    """ Path of the per-sample table of a prediction file, e.g., logs/<model>/
+        test_predictions.txt -> results/samples/<model>/test.npz
+    """
+    folder, pred_file = os.path.split(os.path.abspath(pred_path))
+    mode = pred_file.replace('_predictions.txt', '')
+    model_dir = os.path.relpath(folder, os.path.abspath(LOGS_DIR))
+    return os.path.join(SAMPLES_DIR, model_dir, '%s.npz' % mode)
+
+
+def write_samples(pred_path, gold_path, samples):
+    """ Store the per-sample results of one model for one mode
+    Args:
+        - pred_path, gold_path: files the samples were computed from
+        - samples: dict of arrays with one row per sample: 'preds' (canonical
+            predictions, n_samples x n_preds), 'golds' (canonical golds),
+            'hit_ranks_<hit mode>', 'n_pred_mols' and 'n_gold_mols'
+    """
+    store_path = sample_store_path(pred_path)
+    os.makedirs(os.path.split(store_path)[0], exist_ok=True)
+    arrays = dict(samples)
+    arrays.update({'version': np.array(SAMPLE_STORE_VERSION),
+                   'pred_hash': np.array(hash_file(pred_path)),
+                   'gold_hash': np.array(hash_file(gold_path))})
+    tmp_path = '%s.%s.tmp' % (store_path, os.getpid())
+    with open(tmp_path, 'wb') as f:  # file object: no '.npz' appended
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, store_path)  # readers never see a partial table
+
+
+def load_samples(pred_path, gold_path, keys=None, hashes=None):
+    """ Load the per-sample results written by write_samples, or return None
+        if they do not exist or if the prediction or gold file changed since
+    Args:
+        - pred_path, gold_path: files the samples were computed from
+        - keys: arrays to load (default: all of them), e.g., only hit ranks
+        - hashes: hashes of both files, if the caller already computed them
+    """
+    store_path = sample_store_path(pred_path)
+    if not os.path.exists(store_path):
+        return None
+    if hashes is None:
+        hashes = (hash_file(pred_path), hash_file(gold_path))
+    with np.load(store_path) as store:  # arrays are only read when accessed
+        if int(store['version']) != SAMPLE_STORE_VERSION\
+            or (str(store['pred_hash']), str(store['gold_hash'])) != hashes:
+            return None
+        keys = keys or [key for key in store.files if key not in
+                        ['version', 'pred_hash', 'gold_hash']]
+        return {key: store[key] for key in keys}
+
+
+def hash_file(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
@@ -1,13 +1,21 @@
 import os
+from local_scheduler import ScheduledJob, run_scheduled_jobs
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('-t', '--test', action='store_true')
 parser.add_argument('-r', '--roundtrip', action='store_true')
+parser.add_argument('-c', '--cpus', default=os.cpu_count(), type=int)
+parser.add_argument('-m', '--memory', default=64, type=int)  # in GB
+parser.add_argument('-g', '--gpus', default=1, type=int)
+parser.add_argument('--retries', default=1, type=int)
 args = parser.parse_args()
 
 
-TRANSLATE_SCRIPT = 'python open-nmt/translate.py'
+TRANSLATE_SCRIPT = 'python open-nmt/translate_many.py'
 CONFIGS_DIR = os.path.join('.', 'configs')
+LOGS_DIR = os.path.join('.', 'logs')
+JOURNAL_PATH = os.path.join(LOGS_DIR, 'translate_journal.jsonl')
+TRANSLATE_RESOURCES = {'cpus': 2, 'memory': 8, 'gpus': 1}
 MODES = ['test', 'test-50k', 'roundtrip', 'roundtrip-50k']
 FOLDS = [1, 2, 5, 10, 20]
 DO_TEST = args.test
@@ -29,17 +37,52 @@ def main():
                          '\nIt is first required to run test predictions,'\
                          '\nthen write roundtrip config scripts,'\
                          '\nand only then generate roundtrip predictions.')
-    for mode in modes_to_run:
-        generate_predictions_with_all_models(mode=mode)
+    jobs = generate_prediction_jobs_for_all_models(modes_to_run)
+    failed = run_scheduled_jobs(jobs, args.cpus, args.memory, args.gpus,
+                                JOURNAL_PATH, n_retries=args.retries)
+    if len(failed) > 0:
+        print('Failed jobs (see %s):\n%s' % (JOURNAL_PATH, '\n'.join(failed)))
 
 
-def generate_predictions_with_all_models(mode):
-    for folder, _, files in os.walk(CONFIGS_DIR):
-        if '%s.yml' % mode in files:
-            config_path = os.path.join(folder, '%s.yml' % mode)
-            print('Starting %s' % config_path)
-            os.system('%s -config %s' % (TRANSLATE_SCRIPT, config_path))
-            print('Done %s' % config_path)
+def generate_prediction_jobs_for_all_models(modes):
+    # Each checkpoint is loaded once for all the configs (modes) that use it
+    config_paths_by_model = {}
+    for folder, _, files in sorted(os.walk(CONFIGS_DIR)):
+        for mode in modes:
+            if '%s.yml' % mode in files:
+                config_path = os.path.join(folder, '%s.yml' % mode)
+                model_path = read_config_value(config_path, 'model')
+                config_paths_by_model.setdefault(model_path, [])\
+                                     .append(config_path)
+    stage = 'roundtrip' if DO_ROUNDTRIP else 'test'
+    jobs = []
+    for model_path, config_paths in config_paths_by_model.items():
+        # Roundtrips use the test predictions of the model in their folder,
+        # and only wait for the test job if these predictions are missing
+        # (tests run through slurm or before the journal are not in it)
+        test_configs = [os.path.join(os.path.dirname(c),
+                                     os.path.basename(c).replace(stage, 'test'))
+                        for c in config_paths if stage == 'roundtrip']
+        deps = {'test %s' % read_config_value(c, 'model')
+                for c in test_configs if os.path.exists(c)
+                and not os.path.exists(read_config_value(c, 'output'))}
+        jobs.append(ScheduledJob(
+            name='%s %s' % (stage, model_path),
+            command='%s -configs %s' % (TRANSLATE_SCRIPT,
+                                        ' '.join(config_paths)),
+            deps=tuple(sorted(deps)),
+            log_path=os.path.join(os.path.dirname(os.path.dirname(model_path)),
+                                  '%s.out' % stage),
+            **TRANSLATE_RESOURCES))
+    return jobs
+
+
+def read_config_value(config_path, key):
+    with open(config_path, 'r') as f:
+        for line in f:
+            if line.startswith('%s:' % key):
+                return line.split(':', 1)[1].strip()
+    return None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,160 @@
+import os
+import sys
+import csv
+import random
+import shutil
+import importlib
+import tempfile
+import unittest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+MODEL_DIRS = [os.path.join('reagent-pred', 'smiles', token, 'x1', embed)
+              for token, embed in [('atom', 'from-scratch'),
+                                   ('atom', 'pre-trained'),
+                                   ('spe', 'from-scratch')]]
+GOLDS = {'atom': ['C C O', 'O', 'C . N'],
+         'spe': ['CC O', 'O', 'C . N']}  # other gold file, same molecules
+PREDS = {'from-scratch': ['C C O', 'C O', 'N', 'O', 'N . C', 'C'],
+         'pre-trained': ['C O', 'C C O', 'O', 'N', 'C', 'C . N']}
+
+MOLECULES = ['C', 'O', 'N', 'CC']
+
+
+def compute_topk_hit(preds, gold, mode='strict'):
+    """ Previous, one k at a time, hit computation, used as a reference
+    Args:
+        - preds: list of k best predictions, strings of '.'- separated molecules
+        - gold: ground truth basis for hit computation (same type of string)
+        - mode: whether all or any molecule(s) should be correctly predicted
+    """
+    if mode == 'all':
+        # Requirement: all gold molecules are in the model prediction
+        hit_fn = lambda gold, pred: all([g in pred for g in gold])
+    elif mode == 'any':
+        # Requirement: any of the gold molecules are in the model prediction
+        hit_fn = lambda gold, pred: any([g in pred for g in gold])
+    elif mode == 'strict':
+         # Requirement: exact match between gold and prediction molecules
+         hit_fn = lambda gold, pred: sorted(pred) == sorted(gold)
+    else:
+        raise ValueError('Incorrect mode for compute hit function')
+    # Requirement: at least one of preds (list of length k) deserves a hit
+    return any([hit_fn(remove_duplicates(pred.split('.')),
+                       remove_duplicates(gold.split('.'))) for pred in preds])
+
+
+def remove_duplicates(sequence):
+    seen = set()
+    seen_add = seen.add
+    return [x for x in sequence if not (x in seen or seen_add(x))]
+
+
+def random_molecules(rng):
+    return '.'.join(rng.choice(MOLECULES) for _ in range(rng.randint(1, 3)))
+
+
+def import_evaluate(test_case):
+    # The script parses its arguments and needs rdkit, selfies, numpy and tqdm
+    try:
+        sample_store = importlib.import_module('sample_store')
+        sys.modules.pop('evaluate_all_models', None)
+        return sample_store, importlib.import_module('evaluate_all_models')
+    except ImportError as error:
+        test_case.skipTest('Missing dependency: %s' % error)
+
+
+class TestHitRanks(unittest.TestCase):
+
+    def setUp(self):
+        self.argv = sys.argv
+        sys.argv = ['evaluate_all_models.py']
+
+    def tearDown(self):
+        sys.argv = self.argv
+
+    def test_hit_ranks_match_topk_hits(self):
+        _, evaluate = import_evaluate(self)
+        rng = random.Random(1234)
+        for _ in range(2000):
+            gold = random_molecules(rng)
+            preds = [random_molecules(rng) for _ in range(rng.randint(0, 5))]
+            hit_ranks = evaluate.compute_hit_ranks(preds, gold)
+            for hit_mode, hit_rank in hit_ranks.items():
+                for k in range(1, 7):
+                    self.assertEqual(
+                        hit_rank != evaluate.NO_HIT and hit_rank <= k,
+                        compute_topk_hit(preds[:k], gold, hit_mode),
+                        (preds, gold, hit_mode, k))
+
+
+class TestEvaluateAllModels(unittest.TestCase):
+    """Run the whole evaluation on a tiny logs/data tree."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        for token, golds in GOLDS.items():
+            gold_dir = os.path.join(self.tmp_dir, 'data', 'reagent-pred',
+                                    'smiles', token, 'x1')
+            os.makedirs(gold_dir)
+            with open(os.path.join(gold_dir, 'tgt-test.txt'), 'w') as f:
+                f.write('\n'.join(golds) + '\n')
+        for model_dir in MODEL_DIRS:
+            log_dir = os.path.join(self.tmp_dir, 'logs', model_dir)
+            os.makedirs(log_dir)
+            embed = os.path.basename(model_dir)
+            with open(os.path.join(log_dir, 'test_predictions.txt'), 'w') as f:
+                f.write('\n'.join(PREDS[embed]) + '\n')
+        os.chdir(self.tmp_dir)  # the script works on the current directory
+        self.argv = sys.argv
+        sys.argv = ['evaluate_all_models.py', '-w', '1', '-k', '1', '2',
+                    '-b', '20']
+
+    def tearDown(self):
+        sys.argv = self.argv
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_main(self):
+        sample_store, evaluate = import_evaluate(self)
+        sample_store.LOGS_DIR = os.path.join(self.tmp_dir, 'logs')
+        sample_store.SAMPLES_DIR = os.path.join(self.tmp_dir, 'results',
+                                                'samples')
+        evaluate.main()
+        results_dir = os.path.join(self.tmp_dir, 'results')
+        with open(os.path.join(results_dir, 'results_test.csv')) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], evaluate.HEADERS)
+        accuracies = {tuple(row[2:4]): [float(a) for a in row[5:]]
+                      for row in rows[1:]}
+        # top-1, top-2, lenient-1, lenient-2
+        self.assertEqual(accuracies[('atom', 'from-scratch')],
+                         [2 / 3, 1, 2 / 3, 1])
+        self.assertEqual(accuracies[('atom', 'pre-trained')],
+                         [1 / 3, 1, 2 / 3, 1])
+        self.assertEqual(accuracies[('spe', 'from-scratch')],
+                         [2 / 3, 1, 2 / 3, 1])
+        with open(os.path.join(results_dir, 'results_test_ci.csv')) as f:
+            self.assertEqual(len(list(csv.reader(f))), len(rows))
+
+        # Models are paired across tokenizations, on their canonical golds
+        with open(os.path.join(results_dir, 'paired_tests_test.csv')) as f:
+            pairs = {tuple(row[:2]) for row in list(csv.reader(f))[1:]}
+        model_names = sorted('/'.join(row[:5]) for row in rows[1:])
+        self.assertEqual(pairs, {(a, b) for i, a in enumerate(model_names)
+                                 for b in model_names[i + 1:]})
+        for model_dir in MODEL_DIRS:
+            self.assertTrue(os.path.exists(os.path.join(
+                results_dir, 'samples', model_dir, 'test.npz')))
+
+        # A second run only reads back what the first one stored
+        evaluate.main()
+        with open(os.path.join(results_dir, 'results_test.csv')) as f:
+            self.assertEqual(list(csv.reader(f)), rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,25 +1,62 @@
 import os
+from local_scheduler import ScheduledJob, run_scheduled_jobs
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-c', '--cpus', default=os.cpu_count(), type=int)
+parser.add_argument('-m', '--memory', default=64, type=int)  # in GB
+parser.add_argument('-g', '--gpus', default=1, type=int)
+parser.add_argument('--retries', default=1, type=int)
+args = parser.parse_args()
 
 
 CONFIGS_DIR = os.path.join('.', 'configs')
+LOGS_DIR = os.path.join('.', 'logs')
+JOURNAL_PATH = os.path.join(LOGS_DIR, 'train_journal.jsonl')
 VOCAB_SCRIPT = 'python open-nmt/build_vocab.py'
 TRAIN_SCRIPT = 'python open-nmt/train.py'
 FOLDS = [1, 2, 5, 10, 20]
+VOCAB_RESOURCES = {'cpus': 1, 'memory': 4, 'gpus': 0}
+TRAIN_RESOURCES = {'cpus': 2, 'memory': 16, 'gpus': 1}  # as in base_slurm.sh
 
 
 def main():
-    # Start by the run that take less time
+    # Start by the runs that take less time
+    jobs = []
     for fold in FOLDS:
-        train_one_data_augmentation_level(fold)
+        jobs.extend(generate_one_data_augmentation_level_jobs(fold))
+    failed = run_scheduled_jobs(jobs, args.cpus, args.memory, args.gpus,
+                                JOURNAL_PATH, n_retries=args.retries)
+    if len(failed) > 0:
+        print('Failed jobs (see %s):\n%s' % (JOURNAL_PATH, '\n'.join(failed)))
 
 
-def train_one_data_augmentation_level(fold):
+def generate_one_data_augmentation_level_jobs(fold):
+    folders_by_data = {}  # embed types of the same data share the same vocab
     for folder, subfolders, _ in os.walk(CONFIGS_DIR):
         if len(subfolders) == 0\
         and str(fold) in folder and str(10 * fold) not in folder:
+            data_spec = os.path.dirname(folder)
+            folders_by_data.setdefault(data_spec, []).append(folder)
+    jobs = []
+    for data_spec, folders in folders_by_data.items():
+        vocab_name = 'vocab %s' % data_spec  # counted once for all embed types
+        jobs.append(ScheduledJob(
+            name=vocab_name,
+            command='%s -config %s -n_sample -1'
+                    % (VOCAB_SCRIPT, os.path.join(folders[0], 'train.yml')),
+            log_path=os.path.join(data_spec.replace(CONFIGS_DIR, LOGS_DIR),
+                                  'vocab.out'),
+            **VOCAB_RESOURCES))
+        for folder in folders:  # trainings start once the vocab is written
             config = os.path.join(folder, 'train.yml')
-            os.system('%s -config %s -n_sample -1' % (VOCAB_SCRIPT, config))
-            os.system('%s -config %s' % (TRAIN_SCRIPT, config))
+            jobs.append(ScheduledJob(
+                name='train %s' % folder,
+                command='%s -config %s' % (TRAIN_SCRIPT, config),
+                deps=(vocab_name,),
+                log_path=os.path.join(folder.replace(CONFIGS_DIR, LOGS_DIR),
+                                      'train.out'),
+                **TRAIN_RESOURCES))
+    return jobs
 
 
 if __name__ == '__main__':
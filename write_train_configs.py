@@ -12,10 +12,11 @@ BASE_CONFIG_PATH = os.path.join(DATA_DIR, 'original', 'base_train.yml')
 DATA_REDUCTION_FACTOR = args.reduce  # 0.0625, 0.125, 0.25, 0.5, 1.0 (no reduce)
 N_BASE_TRAIN_STEPS = int(500000 * DATA_REDUCTION_FACTOR)
 N_BASE_VALID_STEPS = int(10000 * DATA_REDUCTION_FACTOR)
+REDUCED_LINES_FILE = 'lines-train-r%s.npy' % DATA_REDUCTION_FACTOR
 EMBED_TYPES = ['from-scratch', 'pre-trained']
 W2V_TEXT = """
 # Add pre-trained embeddings
-both_embeddings: $DATA_FOLDER%sw2v-embeddings.txt
+both_embeddings: $DATA_FOLDER%sw2v-embeddings.npy
 embeddings_type: word2vec
 word_vec_size: 256
 freeze_word_vecs_enc: True
@@ -24,6 +25,8 @@ freeze_word_vecs_dec: True
 NOT_SHARE_VOCAB_TEXT = """tgt_vocab: $DATA_FOLDER$SEPtgt_vocab.vocab
 share_vocab: False"""
 SHARE_VOCAB_TEXT = """share_vocab: True"""
+LINES_TEXT = """
+    path_lines: $DATA_FOLDER$SEP%s""" % REDUCED_LINES_FILE  # reduced data view
 
 
 def main():
@@ -52,12 +55,14 @@ def write_train_config_file(config_folder, data_folder, logs_folder):
     # if 'reagent-pred' in config_folder:
     #     vocab_text = NOT_SHARE_VOCAB_TEXT  # tried it, not better
     if 'pre-trained' in config_folder: to_write += W2V_TEXT
+    lines_text = LINES_TEXT if DATA_REDUCTION_FACTOR < 1.0 else ''
     fold_flag = os.path.basename(data_folder).split('x')[-1]
     n_steps_train_max = str(N_BASE_TRAIN_STEPS * int(fold_flag))
     n_steps_for_valid = str(N_BASE_VALID_STEPS * int(fold_flag))
     config_path = os.path.join(config_folder, 'train.yml')
     with open(config_path, 'w') as f:
         f.writelines(to_write.replace('$VOCAB_TEXT', vocab_text)
+                             .replace('$LINES_TEXT', lines_text)
                              .replace('$LOGS_FOLDER', logs_folder)
                              .replace('$DATA_FOLDER', data_folder)
                              .replace('$N_STEPS_TRAIN_MAX', n_steps_train_max)
@@ -1,10 +1,14 @@
 import os
 import math
+import shutil
+import hashlib
+from multiprocessing import Pool
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('-v', '--vocab', action='store_true')
 parser.add_argument('-s', '--slurm', action='store_true')
 parser.add_argument('-r', '--reduce', default=1.0, type=float)
+parser.add_argument('-w', '--workers', default=1, type=int)
 args = parser.parse_args()
 
 
@@ -13,10 +17,27 @@ LOGS_DIR = os.path.abspath('logs')
 DATA_DIR = os.path.abspath('data')
 SLURM_DIR = os.path.abspath('slurm')
 BASE_SLURM_PATH = os.path.join(DATA_DIR, 'original', 'base_slurm.sh')
+VOCAB_CACHE_DIR = os.path.join(DATA_DIR, 'original', 'vocab_cache')
 VOCAB_SCRIPT = 'python open-nmt/build_vocab.py'
+VOCAB_FLAGS = '-n_sample -1'  # whole corpus
+VOCAB_CONFIG_KEYS = [  # config options with which build_vocab builds a vocab
+    'share_vocab',
+    'src_vocab_size',
+    'tgt_vocab_size',
+    'vocab_size_multiple',
+    'src_words_min_frequency',
+    'tgt_words_min_frequency',
+    'src_seq_length',
+    'tgt_seq_length',
+    'transforms'
+]
+N_WORKERS = args.workers  # number of vocabularies built at the same time
+N_VOCAB_THREADS = max(1, os.cpu_count() // N_WORKERS)  # for one vocabulary
+HASH_BLOCK_SIZE = 1 << 20  # bytes read at once when hashing a corpus file
 DO_VOCAB = args.vocab
 DO_SLURM = args.slurm
 DATA_REDUCTION_FACTOR = args.reduce  # 0.0625, 0.125, 0.25, 0.5, 1.0 (no reduce)
+REDUCED_LINES_FILE = 'lines-train-r%s.npy' % DATA_REDUCTION_FACTOR
 FOLDS = [1, 2, 5, 10, 20]
 TEST_MODES = ['test', 'test-50k', 'roundtrip', 'roundtrip-50k']
 ROUNDTRIP_SPECS = ['atom', 'smiles', 'from-scratch']
@@ -31,27 +52,115 @@ USPTO_50K_TASKS = [
 
 
 def main():
+    config_paths_by_fold = find_train_configs_by_fold()
+    failed = []
+    if DO_VOCAB:
+        failed = build_all_vocabs([path for fold in FOLDS
+                                   for path in config_paths_by_fold[fold]])
     # Separate folders by data augmentation fold (take different times)
-    for fold in FOLDS:
-        write_vocabs_and_slurms_for_one_data_augmentation_level(fold)
-    if DO_VOCAB: print('Vocab files generated!')
+    if DO_SLURM:
+        for fold in FOLDS:
+            for config_path in config_paths_by_fold[fold]:
+                slurm_path = write_train_slurm_script(config_path, fold)
+                write_test_slurm_file(slurm_path)
+    if DO_VOCAB and len(failed) == 0: print('Vocab files generated!')
     if DO_SLURM: print('Slurm bash scripts generated!')
+    if len(failed) > 0:
+        raise SystemExit('Failed vocabs: %s' % ', '.join(failed))
     if not DO_VOCAB and not DO_SLURM:
         raise ValueError('Use this script with one or both of the following '\
             'arguments:\n-v to build vocabularies\n-s to write slurm scripts')
 
 
-def write_vocabs_and_slurms_for_one_data_augmentation_level(fold):
+def find_train_configs_by_fold():
+    # configs/<task>/<format>/<token>/x<fold>/<embed>/train.yml (walked once)
+    config_paths_by_fold = {fold: [] for fold in FOLDS}
     for folder, _, files in os.walk(CONFIGS_DIR):
-        if 'train.yml' in files\
-        and str(fold) in folder and str(10 * fold) not in folder:
-            config_path = os.path.join(folder, 'train.yml')
-            if DO_VOCAB:
-                os.system('%s -config %s -n_sample -1' % (VOCAB_SCRIPT,
-                                                          config_path))
-            if DO_SLURM:
-                slurm_path = write_train_slurm_script(config_path, fold)
-                write_test_slurm_file(slurm_path)
+        if 'train.yml' in files:
+            fold = int(os.path.basename(os.path.dirname(folder)).split('x')[-1])
+            if fold in config_paths_by_fold:
+                config_paths_by_fold[fold].append(
+                    os.path.join(folder, 'train.yml'))
+    return config_paths_by_fold
+
+
+def build_all_vocabs(config_paths):
+    """ Build one vocabulary per distinct training corpus: embed types of the
+        same data folder share their vocab file, and folders whose corpora did
+        not change since a previous run reuse the cached vocab file; returns
+        the data folders whose vocab could not be built (other ones are kept)
+    """
+    os.makedirs(VOCAB_CACHE_DIR, exist_ok=True)
+    config_paths_by_data = {}
+    for config_path in config_paths:
+        config_paths_by_data.setdefault(get_data_folder(config_path),
+                                        config_path)
+    data_folders = list(config_paths_by_data.keys())
+    with Pool(N_WORKERS) as pool:
+        vocab_hashes = pool.map(hash_vocab_corpus,
+                                [config_paths_by_data[f] for f in data_folders])
+        vocab_jobs = {h: config_paths_by_data[f]
+                      for f, h in zip(data_folders, vocab_hashes)}
+        built = dict(zip(vocab_jobs.keys(),
+                         pool.map(build_and_cache_vocab, vocab_jobs.items())))
+    failed = []
+    for data_folder, vocab_hash in zip(data_folders, vocab_hashes):
+        if not built[vocab_hash]:
+            print('- Failed to build the vocab of %s, skipped' % data_folder)
+            failed.append(os.path.relpath(data_folder))
+            continue
+        shutil.copyfile(get_vocab_cache_path(vocab_hash),
+                        os.path.join(data_folder, 'src_vocab.vocab'))
+    return failed
+
+
+def get_data_folder(config_path):
+    config_folder = os.path.dirname(os.path.dirname(config_path))  # no embed
+    return config_folder.replace(CONFIGS_DIR, DATA_DIR)
+
+
+def hash_vocab_corpus(config_path):
+    # Vocab files list tokens by count, ties by order of appearance: the order
+    # of the lines matters, hence a plain hash of the corpus files, to which
+    # are added the options the vocab is built with
+    data_folder = get_data_folder(config_path)
+    corpus_hash = hashlib.sha256(VOCAB_FLAGS.encode())
+    corpus_hash.update(repr(read_vocab_options(config_path)).encode())
+    corpus_files = ['src-train.txt', 'tgt-train.txt']
+    if DATA_REDUCTION_FACTOR < 1.0:
+        corpus_files.append(REDUCED_LINES_FILE)  # lines the vocab is built on
+    for corpus_file in corpus_files:
+        with open(os.path.join(data_folder, corpus_file), 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                corpus_hash.update(block)
+    return corpus_hash.hexdigest()
+
+
+def read_vocab_options(config_path):
+    with open(config_path, 'r') as f:
+        return sorted(line.strip() for line in f
+                      if line.split(':', 1)[0] in VOCAB_CONFIG_KEYS)
+
+
+def get_vocab_cache_path(vocab_hash):
+    return os.path.join(VOCAB_CACHE_DIR, '%s.vocab' % vocab_hash)
+
+
+def build_and_cache_vocab(vocab_job):
+    # All configs share the source and target vocab (see write_train_configs)
+    # Returns whether the vocab is in the cache (False if build_vocab failed)
+    vocab_hash, config_path = vocab_job
+    cache_path = get_vocab_cache_path(vocab_hash)
+    if os.path.exists(cache_path): return True
+    tmp_path = '%s.%s.tmp' % (cache_path, os.getpid())
+    status = os.system('%s -config %s %s -num_threads %s -src_vocab %s'
+                       % (VOCAB_SCRIPT, config_path, VOCAB_FLAGS,
+                          N_VOCAB_THREADS, tmp_path))
+    if status != 0 or not os.path.exists(tmp_path):
+        if os.path.exists(tmp_path): os.remove(tmp_path)  # maybe partial
+        return False
+    os.replace(tmp_path, cache_path)
+    return True
 
 
 def write_train_slurm_script(config_path, fold):